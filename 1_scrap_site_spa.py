@@ -1,27 +1,125 @@
-import requests
+import argparse
+import contextlib
 import csv
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+import spa_metrics
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+
+BASE_URL = "https://www.la-spa.fr/app/wp-json/spa/v1/animals/search/"
+SEED = "683305489696047"  # Même seed à chaque crawl => contenu des pages stable
+OUTPUT_FILE = "animaux_spa_premier.csv"
+STORE_FILE = "animaux_spa_store.json"    # Animaux déjà vus (id -> hash du contenu)
+DELTA_FILE = "animaux_spa_delta.csv"     # Nouveaux + modifiés (mode --delta)
+REMOVED_FILE = "animaux_spa_removed.csv"  # Ids disparus du catalogue (mode --delta)
+ARCHIVE_FILE = "animaux_spa_raw.jsonl.gz"  # JSON brut de chaque page (--archive / --replay)
+
+CONCURRENCY = 8        # Nombre de pages téléchargées en parallèle
+TIMEOUT = 20           # Timeout (secondes) de chaque requête
+MAX_RETRIES = 4        # Nouvelles tentatives sur 429 / 5xx / erreur réseau
+BACKOFF = 0.5          # Attente de base (secondes), doublée à chaque tentative
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
 headers = {
     'User-Agent': 'Mozilla/5.0',
     'Accept': 'application/json',
 }
 
-all_animals = []
-page = 1
-
-while True:
-    url = (
-        f"https://www.la-spa.fr/app/wp-json/spa/v1/animals/search/"
-        f"?api=1&paged={page}&seed=683305489696047")
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        print(f"Erreur {response.status_code} à la page {page}")
-        break
-    data = response.json()
-    animals = data.get('results', [])
-    if not animals:
-        break
+# ============================================================
+# SESSION HTTP (connexions keep-alive partagées)
+# ============================================================
+
+
+def make_session(pool_size=CONCURRENCY):
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def page_url(page, base_url=BASE_URL, seed=SEED):
+    return f"{base_url}?api=1&paged={page}&seed={seed}"
+
+# ============================================================
+# TÉLÉCHARGEMENT D'UNE PAGE (timeout + retry avec backoff)
+# ============================================================
+
+
+class PageError(Exception):
+    def __init__(self, page, status):
+        super().__init__(f"Erreur {status} à la page {page}")
+        self.page = page
+        self.status = status
 
+
+class CrawlIncomplete(Exception):
+    """Des pages sont restées en erreur avant la fin du catalogue : le crawl est tronqué."""
+
+    def __init__(self, pages):
+        super().__init__(pages)  # args = (pages,) : l'exception repasse d'un processus à l'autre
+        self.pages = pages
+
+    def __str__(self):
+        return (f"Crawl incomplet : page(s) {', '.join(map(str, self.pages))} en erreur "
+                "après toutes les tentatives")
+
+
+def fetch_page(session, page, base_url=BASE_URL, seed=SEED,
+               timeout=TIMEOUT, retries=MAX_RETRIES, backoff=BACKOFF):
+    """Retourne le JSON brut de la page (les animaux sont dans `results`)."""
+    url = page_url(page, base_url, seed)
+    for attempt in range(retries + 1):
+        if attempt:
+            spa_metrics.inc("http_retries_total")
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout)
+        except requests.RequestException as e:
+            spa_metrics.observe("http_request_duration_seconds", time.perf_counter() - start)
+            spa_metrics.inc("http_responses_total", status=type(e).__name__)
+            if attempt == retries:
+                raise
+            status = None
+        else:
+            status = response.status_code
+            spa_metrics.observe("http_request_duration_seconds", time.perf_counter() - start)
+            spa_metrics.inc("http_responses_total", status=status)
+            if status == 200:
+                return response.json()
+            if status not in RETRY_STATUS or attempt == retries:
+                raise PageError(page, status)
+
+        # Respecter Retry-After si le serveur l'indique, sinon backoff exponentiel
+        delay = backoff * (2 ** attempt) * (1 + random.random())
+        if status == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = float(retry_after)
+        time.sleep(delay)
+
+    raise PageError(page, "inconnue")
+
+# ============================================================
+# COMPLÉTION DES CHAMPS
+# ============================================================
+
+
+def complete_fields(animals):
     # On s’assure que chaque animal a bien les champs "fad", "expr" et "sos"
     for animal in animals:
         if 'fad' not in animal:
@@ -32,28 +130,486 @@ while True:
             animal['expr'] = False
         if 'sos' not in animal:
             animal['sos'] = False
+    return animals
+
+# ============================================================
+# CRAWL CONCURRENT
+# ============================================================
+
+
+def iter_pages(concurrency=CONCURRENCY, base_url=BASE_URL, seed=SEED,
+               timeout=TIMEOUT, retries=MAX_RETRIES, backoff=BACKOFF, archive=None,
+               shard=(0, 1), failed=None):
+    """Génère (page, animaux) dans l'ordre des pages, `concurrency` requêtes en vol.
+
+    Le nombre de pages n'est pas connu à l'avance : on avance une fenêtre
+    glissante de pages et on arrête d'en soumettre dès qu'une page vide
+    (ou en erreur) marque la fin du catalogue. Les pages arrivées en avance
+    attendent dans un tampon borné à deux fenêtres avant d'être rendues.
+    Si `archive` est fourni, le JSON brut de chaque page y est écrit, dans
+    l'ordre, avant la complétion des champs.
+
+    `shard=(k, n)` ne parcourt que les pages k+1, k+1+n, k+1+2n... : n
+    processus (ou machines) se partagent ainsi un crawl à seed fixe sans
+    connaître le nombre de pages à l'avance.
+
+    Une page encore en erreur après les tentatives arrête aussi le crawl,
+    mais ce n'est pas une fin de catalogue : si elle précède la première
+    page vide, son numéro est ajouté à `failed`, pour que l'appelant sache
+    que la suite manque (et ne la compte pas comme supprimée).
+    """
+    concurrency = max(1, concurrency)
+    index, step = shard
+    ready = {}              # Pages terminées, pas encore rendues
+    last_page = None        # Première page vide / en erreur
+    first_empty = None      # Première page vide : la vraie fin du catalogue
+    errors = []             # Pages en erreur (y compris au-delà de la fin)
+    next_page = index + 1   # Prochaine page à soumettre
+    next_yield = index + 1  # Prochaine page à rendre
+
+    with make_session(concurrency) as session, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = {}
+
+        def submit():
+            nonlocal next_page
+            while (len(in_flight) < concurrency
+                   and next_page < next_yield + 2 * concurrency * step
+                   and (last_page is None or next_page < last_page)):
+                future = pool.submit(fetch_page, session, next_page, base_url, seed,
+                                     timeout, retries, backoff)
+                in_flight[future] = next_page
+                next_page += step
+
+        submit()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    data = future.result()
+                except (PageError, requests.RequestException) as e:
+                    print(e if isinstance(e, PageError) else f"Erreur {e} à la page {page}")
+                    errors.append(page)
+                    data = None
+                animals = (data or {}).get('results', [])
+                if animals:
+                    raw = archive.encode(page, data) if archive is not None else None
+                    ready[page] = (raw, complete_fields(animals))
+                    print(f"Page {page} récupérée, {len(animals)} animaux ajoutés")
+                else:
+                    if last_page is None or page < last_page:
+                        last_page = page
+                    if data is not None and (first_empty is None or page < first_empty):
+                        first_empty = page
+
+            while next_yield in ready:
+                raw, animals = ready.pop(next_yield)
+                if raw is not None:
+                    archive.write(raw)
+                yield next_yield, animals
+                next_yield += step
+            submit()
+
+    if failed is not None:
+        failed.extend(sorted(p for p in errors if first_empty is None or p < first_empty))
+
+
+def crawl(concurrency=CONCURRENCY, base_url=BASE_URL, seed=SEED,
+          timeout=TIMEOUT, retries=MAX_RETRIES, backoff=BACKOFF):
+    """Tout le catalogue en mémoire (pour les appelants qui veulent une liste)."""
+    all_animals = []
+    for _, animals in iter_pages(concurrency, base_url, seed, timeout, retries, backoff):
+        all_animals.extend(animals)
+    return all_animals
+
+# ============================================================
+# ARCHIVE BRUTE ET REJEU HORS-LIGNE
+# ============================================================
+
+
+class RawArchive:
+    """JSONL compressé : une ligne par page, horodatée avec la seed du crawl."""
+
+    def __init__(self, path=ARCHIVE_FILE, seed=SEED):
+        self.path = path
+        self.seed = seed
+        self.crawled_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def encode(self, page, data):
+        return json.dumps({"page": page, "seed": self.seed,
+                           "crawled_at": self.crawled_at, "data": data},
+                          ensure_ascii=False)
+
+    def write(self, line):
+        self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+        print(f"Archive brute : {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_archive_entries(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_archive(path=ARCHIVE_FILE):
+    """Rejoue une archive : même sortie que iter_pages, sans réseau."""
+    for entry in iter_archive_entries(path):
+        animals = entry["data"].get('results', [])
+        if animals:
+            yield entry["page"], complete_fields(animals)
+
+# ============================================================
+# CRAWL PARTITIONNÉ (shards) ET FUSION PAR ID
+# ============================================================
+
+
+def shard_archive_path(index, count, path=ARCHIVE_FILE):
+    base = path[:-len(".jsonl.gz")] if path.endswith(".jsonl.gz") else path
+    return f"{base}.shard-{index + 1}-of-{count}.jsonl.gz"
+
+
+def crawl_shard(index, count, concurrency=CONCURRENCY, base_url=BASE_URL, seed=SEED,
+                timeout=TIMEOUT, retries=MAX_RETRIES, path=None):
+    """Crawl d'un shard vers sa propre archive brute ; retourne son chemin.
+
+    Fonction de niveau module pour pouvoir tourner dans un ProcessPoolExecutor,
+    ou seule sur une autre machine via `--shard K/N`.
+    """
+    path = path or shard_archive_path(index, count)
+    pages = 0
+    failed = []
+    with RawArchive(path, seed) as archive:
+        for _ in iter_pages(concurrency, base_url, seed, timeout, retries,
+                            archive=archive, shard=(index, count), failed=failed):
+            pages += 1
+    if failed:
+        # Un shard tronqué laisserait des trous au milieu du CSV fusionné
+        raise CrawlIncomplete(failed)
+    print(f"Shard {index + 1}/{count} : {pages} pages")
+    return path
+
+
+def crawl_shards(workers, concurrency=CONCURRENCY, base_url=BASE_URL, seed=SEED,
+                 timeout=TIMEOUT, retries=MAX_RETRIES):
+    """Lance `workers` shards dans des processus séparés ; retourne leurs archives."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(crawl_shard, k, workers, concurrency, base_url, seed,
+                               timeout, retries) for k in range(workers)]
+        return [f.result() for f in futures]
+
+
+def iter_merged(paths):
+    """Fusionne des archives de shards par numéro de page, sans doublon d'id.
+
+    Chaque archive est déjà triée par page : heapq.merge les entrelace en flux,
+    ce qui redonne l'ordre d'un crawl unique. Un animal vu sur plusieurs pages
+    (pagination qui glisse entre deux shards) n'est gardé qu'à sa première page.
+    """
+    streams = [iter_archive_entries(p) for p in paths]
+    seen = set()
+    for entry in heapq.merge(*streams, key=lambda e: e["page"]):
+        animals = []
+        for animal in entry["data"].get('results', []):
+            key = animal_key(animal)
+            if key and key in seen:
+                continue
+            seen.add(key)
+            animals.append(animal)
+        if animals:
+            yield entry["page"], complete_fields(animals)
+
+
+def archive_seed(path=ARCHIVE_FILE):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                return json.loads(line).get("seed", SEED)
+    return SEED
+
+# ============================================================
+# ÉCRITURE CSV (en flux, page par page)
+# ============================================================
+
+
+class StreamingCsvWriter:
+    """Écrit les animaux au fil de l'eau dans `path`.
+
+    Les lignes vont d'abord dans `path.part` (ou directement dans `path`
+    avec `live=True`), vidé sur disque après chaque page : un crash ne perd
+    au plus que la page en cours. L'en-tête est celui de la première page ;
+    les nouvelles clés sont ajoutées en fin d'en-tête et le schéma courant
+    est tenu à jour dans `path.keys.json`. À la fermeture, si l'en-tête a
+    grandi, le fichier est recopié ligne à ligne avec l'en-tête final
+    (mémoire constante).
+    """
+
+    def __init__(self, path=OUTPUT_FILE, base_keys=("fad", "expr", "sos"), live=False):
+        self.path = path
+        self.part_path = path if live else path + ".part"
+        self.keys_path = path + ".keys.json"
+        self.fieldnames = list(base_keys)
+        self.header_keys = None  # En-tête écrit avec la première page
+        self.rows = 0
+        self._file = open(self.part_path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+        self._save_keys()
+
+    def _save_keys(self):
+        with open(self.keys_path, "w", encoding="utf-8") as f:
+            json.dump(self.fieldnames, f, ensure_ascii=False)
+
+    def _write_header(self):
+        self.header_keys = list(self.fieldnames)
+        self._writer.writeheader()
+
+    def write_rows(self, animals):
+        known = set(self.fieldnames)
+        grew = False
+        for animal in animals:
+            for key in animal:
+                if key not in known:
+                    self.fieldnames.append(key)  # DictWriter garde une référence
+                    known.add(key)
+                    grew = True
+        if grew:
+            self._save_keys()
+        if self.header_keys is None:
+            self._write_header()
+        self._writer.writerows(animals)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.rows += len(animals)
+
+    def close(self):
+        if self.header_keys is None:
+            self._write_header()
+        self._file.close()
+        if self.fieldnames != self.header_keys:
+            # Réécriture unique de l'en-tête, les lignes courtes sont complétées
+            width = len(self.fieldnames)
+            tmp_path = self.path + ".tmp"
+            with open(self.part_path, newline="", encoding="utf-8") as src, \
+                    open(tmp_path, "w", newline="", encoding="utf-8") as dst:
+                reader = csv.reader(src)
+                writer = csv.writer(dst)
+                next(reader)
+                writer.writerow(self.fieldnames)
+                for row in reader:
+                    writer.writerow(row + [""] * (width - len(row)))
+            os.replace(tmp_path, self.path)
+            if self.part_path != self.path:
+                os.remove(self.part_path)
+        elif self.part_path != self.path:
+            os.replace(self.part_path, self.path)
+        os.remove(self.keys_path)
+        print("Toutes les clés trouvées :", set(self.fieldnames))
+        print(f"CSV créé : {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()  # On garde .part (ou le fichier live) + .keys.json pour inspection
+
+
+# ============================================================
+# CRAWL INCRÉMENTAL (delta par id d'animal)
+# ============================================================
+
+
+def animal_key(animal):
+    return str(animal.get("id", ""))
+
+
+def content_hash(animal):
+    payload = json.dumps(animal, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_store(path=STORE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("animals", {})
+
+
+def save_store(store, path=STORE_FILE, seed=SEED):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"seed": seed, "crawled_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "animals": store}, f)
+    os.replace(tmp, path)  # Écriture atomique : un crash ne corrompt pas le store
+
+
+def delta_status(animal, store):
+    """"new", "changed" ou None si l'animal est inchangé depuis le dernier crawl."""
+    old_hash = store.get(animal_key(animal))
+    if old_hash is None:
+        return "new"
+    if old_hash != content_hash(animal):
+        return "changed"
+    return None
+
+
+def write_removed(removed, path=REMOVED_FILE):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id"])
+        writer.writerows([k] for k in removed)
+
+# ============================================================
+# EXÉCUTION
+# ============================================================
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scraping du catalogue de la SPA")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="pages téléchargées en parallèle (1 = séquentiel)")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT,
+                        help="timeout par requête, en secondes")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="nouvelles tentatives sur 429/5xx")
+    parser.add_argument("--seed", default=SEED)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--delta", action="store_true",
+                        help="n'exporte que les animaux nouveaux/modifiés depuis le dernier crawl")
+    parser.add_argument("--store", default=STORE_FILE)
+    parser.add_argument("--delta-output", default=DELTA_FILE)
+    parser.add_argument("--removed-output", default=REMOVED_FILE)
+    parser.add_argument("--archive", nargs="?", const=ARCHIVE_FILE, default=None,
+                        help="sauvegarde le JSON brut de chaque page (jsonl.gz)")
+    parser.add_argument("--replay", nargs="?", const=ARCHIVE_FILE, default=None,
+                        help="reconstruit le CSV depuis une archive, sans réseau")
+    parser.add_argument("--shard", default=None, metavar="K/N",
+                        help="ne crawle que le shard K sur N vers sa propre archive")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="crawl partitionné sur N processus puis fusion par id")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="ARCHIVE",
+                        help="fusionne des archives de shards en un seul CSV")
+    spa_metrics.add_arguments(parser, "1_scrap")
+    return parser.parse_args(argv)
+
+
+def open_pages(args, stack, failed=None):
+    """Source des pages selon les options : fusion de shards, rejeu d'archive ou crawl.
+
+    `failed` reçoit les pages restées en erreur (crawl seulement, voir iter_pages)."""
+    if args.merge:
+        return iter_merged(args.merge)
+    if args.replay:
+        return iter_archive(args.replay)
+    archive = stack.enter_context(RawArchive(args.archive, args.seed)) if args.archive else None
+    return iter_pages(args.concurrency, args.base_url, args.seed,
+                      args.timeout, args.retries, archive=archive, failed=failed)
+
+
+def crawl_records(args):
+    """Tout le catalogue en mémoire, avec les mêmes sources que main (pour le pipeline)."""
+    failed = []
+    with contextlib.ExitStack() as stack, spa_metrics.stage("scrape") as stage:
+        records = [animal for _, animals in open_pages(args, stack, failed) for animal in animals]
+        stage.rows = len(records)
+    if failed:
+        raise CrawlIncomplete(failed)
+    return records
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with spa_metrics.session(args):
+        run(args)
+
+
+def run(args):
+    start = time.perf_counter()
+    old_store = load_store(args.store) if args.delta else {}
+    store = {}
+    counts = {"new": 0, "changed": 0}
 
-    all_animals.extend(animals)
-    print(f"Page {page} récupérée, {len(animals)} animaux ajoutés")
-    page += 1
+    try:
+        if args.shard:
+            k, n = (int(x) for x in args.shard.split("/"))
+            path = args.archive or shard_archive_path(k - 1, n)
+            crawl_shard(k - 1, n, args.concurrency, args.base_url, args.seed,
+                        args.timeout, args.retries, path)
+            return
+        if args.workers > 1:
+            args.merge = crawl_shards(args.workers, args.concurrency, args.base_url,
+                                      args.seed, args.timeout, args.retries)
+    except CrawlIncomplete as e:
+        print(f"Erreur : {e} ; rien n'est fusionné", file=sys.stderr)
+        sys.exit(1)
+    if args.merge:
+        args.seed = archive_seed(args.merge[0])
+    elif args.replay:
+        args.seed = archive_seed(args.replay)
 
-print(f"Total animaux récupérés : {len(all_animals)}")
+    failed = []
+    try:
+        with contextlib.ExitStack() as stack:
+            stage = stack.enter_context(spa_metrics.stage("scrape"))
+            writer = stack.enter_context(StreamingCsvWriter(args.output))
+            delta_writer = (stack.enter_context(StreamingCsvWriter(args.delta_output))
+                            if args.delta else None)
 
-# --- Détection de toutes les clés possibles ---
-all_keys = set()
-for animal in all_animals:
-    all_keys.update(animal.keys())
+            for _, animals in open_pages(args, stack, failed):
+                writer.write_rows(animals)
+                delta_rows = []
+                for animal in animals:
+                    if delta_writer is not None:
+                        status = delta_status(animal, old_store)
+                        if status:
+                            counts[status] += 1
+                            delta_rows.append(dict(animal, delta_status=status))
+                    key = animal_key(animal)
+                    if key:
+                        store[key] = content_hash(animal)
+                if delta_rows:
+                    delta_writer.write_rows(delta_rows)
+            stage.rows = writer.rows
+            if delta_writer is not None:
+                # En-tête complet même sans aucune ligne : l'étape 2 attend au moins `description`
+                missing = [k for k in writer.fieldnames + ["delta_status"] if k not in delta_writer.fieldnames]
+                delta_writer.fieldnames.extend(missing)
 
-# On s’assure que les colonnes clés sont bien là
-for key in ["fad", "expr", "sos"]:
-    all_keys.add(key)
+            print(f"Total animaux récupérés : {writer.rows} "
+                  f"en {time.perf_counter() - start:.1f}s")
+            if failed:
+                # Sortie par exception : comme après un crash, les écrivains gardent
+                # leur .part et les CSV du crawl précédent restent en place
+                raise CrawlIncomplete(failed)
+    except CrawlIncomplete as e:
+        # Les animaux des pages manquantes ne sont pas supprimés : on ne touche
+        # ni aux CSV, ni à la liste des suppressions, ni au store, le prochain
+        # crawl repartira de l'état précédent.
+        print(f"Erreur : {e} ; {args.output}, {args.store} et les fichiers du delta ne sont "
+              f"pas remplacés (crawl partiel dans {args.output}.part)", file=sys.stderr)
+        sys.exit(1)
 
-print("Toutes les clés trouvées :", all_keys)
+    if args.delta:
+        removed = sorted(k for k in old_store if k not in store)
+        write_removed(removed, args.removed_output)
+        print(f"Delta : {counts['new']} nouveaux, {counts['changed']} modifiés, "
+              f"{len(removed)} supprimés")
+    save_store(store, args.store, args.seed)
 
-# --- Écriture dans un CSV ---
-with open('animaux_spa_premier.csv', 'w', newline='', encoding='utf-8') as csvfile:
-    writer = csv.DictWriter(csvfile, fieldnames=list(all_keys))
-    writer.writeheader()
-    writer.writerows(all_animals)
 
-print("CSV créé : animaux_spa_premier.csv")
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
-import pandas as pd
+import argparse
+import asyncio
+import hashlib
+import importlib
 import json
+import os
+import random
 import re
+import sqlite3
+import time
+import unicodedata
+import pandas as pd
 from tqdm import tqdm
-from openai import OpenAI
-from pathlib import Path
+import spa_io
+import spa_metrics
 
 # ============================================================
 # CONFIGURATION
@@ -12,44 +21,75 @@ from pathlib import Path
 API_KEY = (
     "sk....."
 )
+BACKEND = "openai"  # "openai", "local" (hors-ligne) ou "hybrid" (local puis API si doute)
+MODEL = "gpt-4o-mini"
+BASE_URL = None  # None = API OpenAI ; sinon un endpoint compatible (stub local...)
 INPUT_FILE = "animaux_spa_premier.csv"
 OUTPUT_FILE = "animaux_spa_key_words.csv"
-SAVE_INTERVAL = 50  # Sauvegarde automatique toutes les 50 lignes
+JOURNAL_FILE = "animaux_spa_key_words.journal.jsonl"  # Une ligne JSON par ligne terminée
+SAVE_INTERVAL = 50  # Journal forcé sur disque (fsync) toutes les 50 lignes
+BATCH_SIZE = 1      # Descriptions regroupées dans un même prompt (1 = une par appel)
+BATCH_JOB_FILE = "animaux_spa_batch_job.jsonl"  # Fichier de requêtes pour l'API Batch
+PROGRESS = True  # Barres de progression et résumés (coupés par le pipeline en streaming)
+LIST_FORMAT = "repr"  # Cellules de listes : "repr" (['a', 'b'], historique) ou "json" (["a", "b"])
 
-client = OpenAI(api_key=API_KEY)
-tqdm.pandas()
+# Mode asynchrone : N requêtes en vol, sous les limites du compte
+CONCURRENCY = 16
+RPM_LIMIT = 500         # Requêtes par minute
+TPM_LIMIT = 200_000     # Tokens par minute
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5  # Backoff exponentiel avec jitter : 0.5s, 1s, 2s... (±50 %)
+RETRY_MAX_DELAY = 30
+STRUCTURED_OUTPUT = True  # Demande au modèle une sortie conforme au schéma JSON
+OUTPUT_TOKENS_ESTIMATE = 150  # Tokens de sortie réservés par requête
+# Prix en dollars par million de tokens (entrée, sortie), pour le coût estimé des métriques
+MODEL_PRICES = {"gpt-4o-mini": (0.15, 0.60), "gpt-4o": (2.50, 10.00)}
 
-# ============================================================
-# CHARGEMENT DU FICHIER
-# ============================================================
+# Cache disque des réponses (SQLite), invalidé si le modèle ou le prompt change
+CACHE_FILE = "animaux_spa_llm_cache.sqlite"
+CACHE_MAX_ENTRIES = 200_000
+CACHE_MAX_AGE_DAYS = 90
+
+# Mode hybride : confiance minimale de l'extracteur local pour ne pas appeler l'API
+HYBRID_THRESHOLD = 0.5
+
+KEYWORD_COLUMNS = ["reason_abandon", "behavior_keywords", "compatibility_keywords",
+                   "health_keywords", "adoption_keywords"]
+STATUS_COLUMN = "status"  # ok / retried / failed, par ligne
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": "array", "items": {"type": "string"}}
+                   for key in KEYWORD_COLUMNS},
+    "required": KEYWORD_COLUMNS,
+    "additionalProperties": False,
+}
+
+_client = None
+_cache = None
 
-df = pd.read_csv(INPUT_FILE)
-if "description" not in df.columns:
-    raise ValueError("La colonne 'description' est manquante dans ton fichier CSV.")
 
-# Reprise si un fichier de sortie existe déjà
-if Path(OUTPUT_FILE).exists():
-    print(f"Reprise depuis {OUTPUT_FILE}")
-    df_existing = pd.read_csv(OUTPUT_FILE)
-    if "behavior_keywords" in df_existing.columns:
-        df = df_existing.copy()
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        # Les retries sont gérés par request_description (backoff + réparation)
+        _client = OpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=0)
+    return _client
 
 # ============================================================
 # FONCTION D’ANALYSE — VERSION MOTS-CLÉS
 # ============================================================
 
 
-def analyze_description(text):
-    if pd.isna(text) or len(text.strip()) == 0:
-        return {
-            "reason_abandon": [],
-            "behavior_keywords": [],
-            "compatibility_keywords": [],
-            "health_keywords": [],
-            "adoption_keywords": []
-        }
+def empty_result(status="ok"):
+    result = {key: [] for key in KEYWORD_COLUMNS}
+    result[STATUS_COLUMN] = status
+    return result
+
 
-    prompt = f""" Analyse la description suivante d'un animal
+def build_prompt(text):
+    return f""" Analyse la description suivante d'un animal
     d'un refuge et génère uniquement des mots-clés concis.
     Identifie :
     - la raison de l’abandon
@@ -71,27 +111,109 @@ def analyze_description(text):
     }}
     """
 
-    try:
-        response = client.responses.create(
-            model="gpt-4o-mini",
-            input=prompt,
-            temperature=0
-        )
 
-        content = response.output[0].content[0].text.strip()
-        match = re.search(r"\{.*\}", content, re.DOTALL)
+def response_text(response):
+    # Objet du SDK, ou dict brut (corps d'une réponse de l'API Batch)
+    if isinstance(response, dict):
+        return response["output"][0]["content"][0]["text"].strip()
+    return response.output[0].content[0].text.strip()
+
 
-        if not match:
-            raise ValueError("Réponse non-JSON")
-        result = json.loads(match.group(0))
+def record_llm_call(start, response=None, error=None):
+    """Latence, issue et consommation (tokens, coût estimé) d'un appel à l'API."""
+    spa_metrics.observe("llm_request_duration_seconds", time.perf_counter() - start)
+    spa_metrics.inc("llm_requests_total", outcome="ok" if error is None else type(error).__name__)
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    spa_metrics.inc("llm_tokens_total", usage.input_tokens, kind="input")
+    spa_metrics.inc("llm_tokens_total", usage.output_tokens, kind="output")
+    price_in, price_out = MODEL_PRICES.get(MODEL, (0, 0))
+    spa_metrics.inc("llm_cost_usd_total",
+                    (usage.input_tokens * price_in + usage.output_tokens * price_out) / 1e6)
 
+
+def create_response(**kwargs):
+    start = time.perf_counter()
+    try:
+        response = get_client().responses.create(**kwargs)
     except Exception as e:
-        print(f"Erreur API ou parsing : {e}")
-        result = {}
+        record_llm_call(start, error=e)
+        raise
+    record_llm_call(start, response)
+    return response
+
+
+def request_kwargs(prompt, structured=None):
+    kwargs = {"model": MODEL, "input": prompt, "temperature": 0}
+    if STRUCTURED_OUTPUT if structured is None else structured:
+        kwargs["text"] = {"format": {"type": "json_schema", "name": "mots_cles",
+                                     "schema": RESPONSE_SCHEMA, "strict": True}}
+    return kwargs
+
+# ============================================================
+# VALIDATION ET POLITIQUE DE RETRY
+# ============================================================
+
+
+class InvalidResponse(ValueError):
+    """Réponse reçue mais inexploitable : on peut redemander au modèle de la corriger."""
+
+    def __init__(self, message, reply=""):
+        super().__init__(message)
+        self.reply = reply
+
+
+def validate_result(raw, reply=""):
+    if not isinstance(raw, dict):
+        raise InvalidResponse("un objet JSON est attendu", reply)
+    missing = [key for key in KEYWORD_COLUMNS if key not in raw]
+    if missing:
+        raise InvalidResponse(f"clés manquantes : {', '.join(missing)}", reply)
+    for key in KEYWORD_COLUMNS:
+        val = raw[key]
+        if not isinstance(val, str) and not (
+                isinstance(val, list) and all(isinstance(v, str) for v in val)):
+            raise InvalidResponse(f"'{key}' doit être une liste de chaînes", reply)
+    return {key: raw[key] for key in KEYWORD_COLUMNS}
+
+
+def parse_response(response):
+    content = response_text(response)
+    match = re.search(r"\{.*\}", content, re.DOTALL)
+
+    if not match:
+        raise InvalidResponse("Réponse non-JSON", content)
+    try:
+        raw = json.loads(match.group(0))
+    except json.JSONDecodeError as e:
+        raise InvalidResponse(f"JSON invalide : {e}", content)
+    return validate_result(raw, content)
+
 
+def build_repair_prompt(text, reply, error):
+    return build_prompt(text) + f"""
+    Ta réponse précédente était invalide ({error}) :
+    \"\"\"{reply[:2000]}\"\"\"
+
+    Corrige-la : retourne UNIQUEMENT le JSON demandé, avec les 5 clés,
+    chacune associée à une liste de chaînes.
+    """
+
+
+def backoff_delay(attempt):
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def is_retryable(error):
+    import openai
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError,
+                              openai.InternalServerError))
+
+
+def normalize_result(result):
     # Normalisation : minuscules, suppression des doublons et espaces
-    for key in ["reason_abandon", "behavior_keywords", "compatibility_keywords",
-                "health_keywords", "adoption_keywords"]:
+    for key in KEYWORD_COLUMNS:
         val = result.get(key)
         if isinstance(val, list):
             cleaned = sorted(set(v.lower().strip() for v in val if isinstance(v, str)))
@@ -104,25 +226,1046 @@ def analyze_description(text):
     return result
 
 
+def is_empty(text):
+    return pd.isna(text) or len(str(text).strip()) == 0
+
+# ============================================================
+# CACHE PERSISTANT (adressé par contenu)
+# ============================================================
+
+
+def prompt_version():
+    """Hash des gabarits de prompt : les modifier invalide les entrées du cache."""
+    templates = build_prompt("\x00") + build_batch_prompt([("\x00", "\x00")])
+    return hashlib.sha256(templates.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", str(text))
+    return " ".join(text.split()).casefold()
+
+
+class KeywordCache:
+    """Cache SQLite : hash(description normalisée, modèle, prompt) -> 5 listes.
+
+    Les entrées d'un autre modèle ou d'un autre prompt ne sont jamais lues
+    (clé différente) et sont purgées à l'ouverture, tout comme celles plus
+    vieilles que `max_age_days` ; au-delà de `max_entries`, les moins
+    récemment utilisées sont supprimées.
+    """
+
+    def __init__(self, path=CACHE_FILE, model=MODEL, max_entries=CACHE_MAX_ENTRIES,
+                 max_age_days=CACHE_MAX_AGE_DAYS):
+        self.model = model
+        self.version = prompt_version()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS keywords (
+            key TEXT PRIMARY KEY, model TEXT, prompt_version TEXT,
+            result TEXT, created REAL, last_used REAL)""")
+        self.evict(max_entries, max_age_days)
+
+    def key(self, text):
+        payload = "\x1f".join([normalize_text(text), self.model, self.version])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        key = self.key(text)
+        row = self.db.execute("SELECT result FROM keywords WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            spa_metrics.inc("llm_cache_lookups_total", result="miss")
+            return None
+        self.hits += 1
+        spa_metrics.inc("llm_cache_lookups_total", result="hit")
+        self.db.execute("UPDATE keywords SET last_used = ? WHERE key = ?", (time.time(), key))
+        result = json.loads(row[0])
+        result[STATUS_COLUMN] = "ok"  # Seules les réponses valides sont en cache
+        return result
+
+    def put(self, text, result):
+        now = time.time()
+        stored = {key: result[key] for key in KEYWORD_COLUMNS}
+        self.db.execute("INSERT OR REPLACE INTO keywords VALUES (?, ?, ?, ?, ?, ?)",
+                        (self.key(text), self.model, self.version,
+                         json.dumps(stored, ensure_ascii=False), now, now))
+
+    def evict(self, max_entries=CACHE_MAX_ENTRIES, max_age_days=CACHE_MAX_AGE_DAYS):
+        self.db.execute("DELETE FROM keywords WHERE model != ? OR prompt_version != ?",
+                        (self.model, self.version))
+        self.db.execute("DELETE FROM keywords WHERE created < ?",
+                        (time.time() - max_age_days * 86400,))
+        self.db.execute("""DELETE FROM keywords WHERE key IN (
+            SELECT key FROM keywords ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                        (max_entries,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"Cache : {self.hits} hits, {self.misses} misses ({rate:.0%} de hits)"
+
+    def close(self):
+        self.db.close()
+
+
+def analyze_description(text):
+    return BACKENDS[BACKEND](text)
+
+
+def analyze_description_openai(text):
+    if is_empty(text):
+        return empty_result()
+
+    if _cache is not None:
+        cached = _cache.get(text)
+        if cached is not None:
+            return cached
+
+    return request_description(text)
+
+
+def request_description(text, retries=None):
+    """Appel avec politique de retry ; le résultat porte son statut.
+
+    Erreur réseau / 429 / 5xx : même prompt après un backoff exponentiel
+    avec jitter. Réponse invalide : prompt de réparation qui renvoie au
+    modèle sa réponse et l'erreur. Après `retries` échecs : statut "failed".
+    """
+    retries = MAX_RETRIES if retries is None else retries
+    prompt = build_prompt(text)
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            spa_metrics.inc("llm_retries_total")
+        try:
+            response = create_response(**request_kwargs(prompt))
+            result = normalize_result(parse_response(response))
+        except InvalidResponse as e:
+            error = e
+            prompt = build_repair_prompt(text, e.reply, e)
+            continue
+        except Exception as e:
+            error = e
+            if not is_retryable(e):
+                break
+            if attempt < retries:  # Pas d'attente après la dernière tentative
+                time.sleep(backoff_delay(attempt))
+            continue
+
+        if _cache is not None:
+            _cache.put(text, result)
+        result[STATUS_COLUMN] = "ok" if attempt == 0 else "retried"
+        return result
+
+    print(f"Erreur API ou parsing : {error}")
+    return empty_result("failed")
+
+# ============================================================
+# BACKEND LOCAL (hors-ligne, à partir des règles de 4_csv_final.py)
+# ============================================================
+
+# Raisons d'abandon : racine cherchée dans le texte -> mot-clé produit
+REASON_LEXICON = [
+    ("deces", "décès_propriétaire"), ("decede", "décès_propriétaire"),
+    ("demenag", "déménagement"), ("allergi", "allergie"),
+    ("separation", "séparation"), ("divorce", "séparation"),
+    ("naissance", "arrivée_bébé"), ("bebe", "arrivée_bébé"),
+    ("errant", "errance"), ("errance", "errance"), ("trouve", "errance"),
+    ("saisi", "saisie"), ("maltrait", "maltraitance"), ("fourriere", "fourrière"),
+    ("ehpad", "entrée_ehpad"), ("maison_de_retraite", "entrée_ehpad"),
+    ("hospitalis", "hospitalisation_propriétaire"), ("manque_de_temps", "manque_de_temps"),
+    ("financ", "raisons_financières"), ("portee", "portée_non_désirée"),
+    ("abandon", "abandon"),
+]
+
+# Compatibilités : sujet, racines qui le désignent
+COMPAT_SUBJECTS = [
+    ("chats", ("chat", "felin", "minou")),
+    ("chiens", ("chien", "canin", "toutou")),
+    ("enfants", ("enfant", "bambin")),
+]
+# Indices regardés dans les mots qui précèdent la mention : mot exact si
+# court (pas, ni...), début de mot sinon (evit -> évite, éviter...)
+COMPAT_NEGATIVE = ("pas", "non", "sans", "ni", "jamais", "evit", "incompatib")
+COMPAT_POSITIVE = ("ok", "oui", "avec", "aime", "entend", "compatib", "habitu", "cohabit",
+                   "adore", "apprecie", "sociable")
+COMPAT_WINDOW = 4
+
+_local_patterns = None
+
+
+def _rule_pattern(rules):
+    """Une regex par famille : n'importe quelle racine au début d'un mot, mot complet capturé."""
+    subs = sorted({sub for _, rule in rules for sub in rule["substr"]}, key=len, reverse=True)
+    alternatives = "|".join(re.escape(sub) for sub in subs)
+    return re.compile(rf"(?:^|(?<=_))(?:{alternatives})[a-z0-9']*")
+
+
+def local_patterns():
+    global _local_patterns
+    if _local_patterns is None:
+        rules = importlib.import_module("4_csv_final")
+        _local_patterns = {
+            "norm": rules.norm,
+            "behavior_keywords": _rule_pattern(rules.BEHAVIOR_RULES),
+            "health_keywords": _rule_pattern(rules.HEALTH_RULES),
+            "adoption_keywords": _rule_pattern(rules.ADOPT_RULES),
+        }
+    return _local_patterns
+
+
+def _has_cue(words, cues):
+    return any(w == cue if len(cue) <= 3 else w.startswith(cue)
+               for w in words for cue in cues)
+
+
+def _compatibility_keywords(words):
+    tags = []
+    for i, word in enumerate(words):
+        for subject, stems in COMPAT_SUBJECTS:
+            if not word.startswith(stems):
+                continue
+            before = words[max(0, i - COMPAT_WINDOW):i]
+            if _has_cue(before, COMPAT_NEGATIVE):
+                tag = f"{subject}_non"
+            elif _has_cue(before, COMPAT_POSITIVE):
+                tag = f"{subject}_ok"
+            else:
+                continue  # Simple mention ("un chien calme"), pas une compatibilité
+            if tag not in tags:
+                tags.append(tag)
+    return tags
+
+
+def extract_keywords_local_scored(text):
+    """Mêmes 5 listes que le modèle, sans réseau, + une confiance dans [0, 1].
+
+    Les listes behavior/health/adoption contiennent les mots de la
+    description qui déclenchent une règle de 4_csv_final.py (ils seront donc
+    recatégorisés pareil en fin de chaîne) ; raisons d'abandon et
+    compatibilités viennent de petits lexiques. La confiance est la part
+    des quatre familles principales pour lesquelles quelque chose a été trouvé.
+    """
+    if is_empty(text):
+        return empty_result(), 1.0
+
+    patterns = local_patterns()
+    joined = patterns["norm"](text).replace("/", "_").replace("+", "_")
+    words = [w for w in joined.split("_") if w]
+
+    result = empty_result()
+    for key in ("behavior_keywords", "health_keywords", "adoption_keywords"):
+        result[key] = list(dict.fromkeys(patterns[key].findall(joined)))
+    result["compatibility_keywords"] = _compatibility_keywords(words)
+    result["reason_abandon"] = list(dict.fromkeys(
+        label for stem, label in REASON_LEXICON if stem in joined))
+
+    families = ("behavior_keywords", "health_keywords", "adoption_keywords",
+                "compatibility_keywords")
+    confidence = sum(bool(result[key]) for key in families) / len(families)
+    return normalize_result(result), confidence
+
+
+def extract_keywords_local(text):
+    return extract_keywords_local_scored(text)[0]
+
+
+def analyze_description_hybrid(text):
+    result, confidence = extract_keywords_local_scored(text)
+    if confidence >= HYBRID_THRESHOLD:
+        return result
+    return analyze_description_openai(text)
+
+
+BACKENDS = {
+    "openai": analyze_description_openai,
+    "local": extract_keywords_local,
+    "hybrid": analyze_description_hybrid,
+}
+
+# ============================================================
+# MODE ASYNCHRONE — ORDONNANCEUR TOKEN-BUCKET
+# ============================================================
+
+
+def estimate_tokens(prompt):
+    # ~4 caractères par token en français, plus la réponse attendue
+    return len(prompt) // 4 + OUTPUT_TOKENS_ESTIMATE
+
+
+class TokenBucket:
+    """Double seau à jetons (requêtes/min et tokens/min) qui s'adapte aux 429.
+
+    Un 429 réduit le débit courant d'un quart et bloque les envois pendant
+    le Retry-After ; chaque succès le remonte linéairement vers la limite
+    configurée (AIMD).
+    """
+
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        self.max_rpm = rpm
+        self.max_tpm = tpm
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens):
+        async with self._lock:
+            while True:
+                self._refill()
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                # Le seau ne dépasse jamais le débit courant (abaissé par les 429) :
+                # une requête plus grosse part quand il est plein et le laisse en
+                # négatif, ce qui retarde d'autant les suivantes.
+                need_req = min(1, self.rpm)
+                need_tok = min(tokens, self.tpm)
+                if self.requests >= need_req and self.tokens >= need_tok:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait_req = (need_req - self.requests) * 60 / self.rpm if self.requests < need_req else 0
+                wait_tok = (need_tok - self.tokens) * 60 / self.tpm if self.tokens < need_tok else 0
+                await asyncio.sleep(max(wait_req, wait_tok, 0.01))
+
+    def penalize(self, retry_after=None):
+        now = time.monotonic()
+        # Plusieurs 429 pour la même saturation ne comptent qu'une fois
+        if now >= self.blocked_until:
+            self.rpm = max(self.max_rpm * 0.1, self.rpm * 0.75)
+            self.tpm = max(self.max_tpm * 0.1, self.tpm * 0.75)
+        delay = retry_after if retry_after else 1.0
+        self.blocked_until = max(self.blocked_until, now + delay)
+
+    def reward(self):
+        self.rpm = min(self.max_rpm, self.rpm + self.max_rpm * 0.01)
+        self.tpm = min(self.max_tpm, self.tpm + self.max_tpm * 0.01)
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def request_async(aclient, prompt, bucket, semaphore, parse, retries=MAX_RETRIES,
+                        repair=None, structured=None):
+    """Un appel sous le seau à jetons, avec la même politique que request_description.
+
+    Retourne (parse(réponse), nombre de tentatives) ou lève la dernière erreur.
+    `repair(réponse, erreur)` construit le prompt de réparation ; sans lui,
+    une réponse invalide est une erreur définitive.
+    """
+    import openai
+
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            spa_metrics.inc("llm_retries_total")
+        await bucket.acquire(estimate_tokens(prompt))
+        try:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await aclient.responses.create(**request_kwargs(prompt, structured))
+                except Exception as e:
+                    record_llm_call(start, error=e)
+                    raise
+                record_llm_call(start, response)
+            bucket.reward()
+            return parse(response), attempt + 1
+        except InvalidResponse as e:
+            error = e
+            if repair is None:
+                break
+            prompt = repair(e.reply, e)
+        except openai.RateLimitError as e:
+            bucket.penalize(retry_after_seconds(e))
+            error = e
+        except Exception as e:
+            error = e
+            if not is_retryable(e):
+                break
+            if attempt < retries:  # Pas d'attente après la dernière tentative
+                await asyncio.sleep(backoff_delay(attempt))
+    raise error
+
+
+async def request_description_async(aclient, text, bucket, semaphore, retries=MAX_RETRIES):
+    try:
+        raw, attempts = await request_async(
+            aclient, build_prompt(text), bucket, semaphore, parse_response, retries,
+            repair=lambda reply, error: build_repair_prompt(text, reply, error))
+    except Exception as e:
+        print(f"Erreur API ou parsing : {e}")
+        return empty_result("failed")
+    result = normalize_result(raw)
+    if _cache is not None:
+        _cache.put(text, result)
+    result[STATUS_COLUMN] = "ok" if attempts == 1 else "retried"
+    return result
+
+
+class AsyncSession:
+    """Boucle asyncio, client, seau à jetons et sémaphore d'un run entier.
+
+    Pour un appelant qui traite plusieurs morceaux à la suite (mode
+    streaming) : les limites RPM/TPM et le ralentissement après un 429
+    s'appliquent sur tout le run au lieu de repartir à zéro à chaque page.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        from openai import AsyncOpenAI
+
+        self.loop = asyncio.new_event_loop()
+        # Les retries sont gérés ici, pas par le client (sinon ils contournent le seau)
+        self.aclient = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=0)
+        self.bucket = TokenBucket(rpm, tpm)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        try:
+            self.run(self.aclient.close())
+        finally:
+            self.loop.close()
+
+
+async def analyze_all_async(texts, concurrency=CONCURRENCY, rpm=RPM_LIMIT, tpm=TPM_LIMIT,
+                            retries=MAX_RETRIES, batch_size=BATCH_SIZE, known=None,
+                            on_result=None, session=None):
+    """Analyse toutes les descriptions, N appels en vol ; résultats dans l'ordre d'entrée.
+
+    `on_result(index, résultat)` est appelé dès qu'une description est terminée.
+    Avec `session` (AsyncSession, exécutée dans sa boucle), client, seau et
+    sémaphore sont ceux de la session, et le client reste ouvert.
+    """
+    from openai import AsyncOpenAI
+
+    if session is not None:
+        aclient, bucket, semaphore = session.aclient, session.bucket, session.semaphore
+    else:
+        aclient = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=0)
+        bucket = TokenBucket(rpm, tpm)
+        semaphore = asyncio.Semaphore(concurrency)
+    results = [None] * len(texts)
+
+    async def worker(start):
+        chunk = texts[start:start + batch_size]
+        chunk_results, pending = split_cached(chunk, start, known)
+        found = await analyze_batch_async(aclient, pending, bucket, semaphore, retries)
+        for rid, result in found.items():
+            chunk_results[int(rid) - start] = result
+        results[start:start + len(chunk)] = chunk_results
+        if on_result is not None:
+            for j, result in enumerate(chunk_results):
+                on_result(start + j, result)
+
+    tasks = [asyncio.create_task(worker(start)) for start in range(0, len(texts), batch_size)]
+    try:
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks),
+                         desc="Analyse des descriptions (async)", disable=not PROGRESS):
+            await task
+    finally:
+        if session is None:
+            await aclient.close()
+    return results
+
+# ============================================================
+# REQUÊTES GROUPÉES (K descriptions par prompt)
+# ============================================================
+
+
+def build_batch_prompt(items):
+    rows = [{"id": rid, "description": str(text)} for rid, text in items]
+    return f""" Analyse chacune des descriptions suivantes d'animaux
+    d'un refuge et génère uniquement des mots-clés concis.
+    Pour chaque description, identifie :
+    - la raison de l’abandon
+    - le comportement
+    - les compatibilités (chiens, chats, enfants)
+    - la santé
+    - les besoins pour l’adoption
+
+    Descriptions (JSON) :
+    {json.dumps(rows, ensure_ascii=False)}
+
+    Retourne UNIQUEMENT un tableau JSON valide, avec exactement un objet
+    par description, qui reprend son "id" :
+    [
+      {{
+        "id": "...",
+        "reason_abandon": ["mot1", "mot2"],
+        "behavior_keywords": ["mot1", "mot2", "mot3"],
+        "compatibility_keywords": ["chiens_ok", "chats_non", "enfants_oui"],
+        "health_keywords": ["stérilisé", "vacciné", "malade"],
+        "adoption_keywords": ["calme", "affectueux", "maison_jardin"]
+      }}
+    ]
+    """
+
+
+def parse_batch_response(response, ids):
+    """{id: résultat brut} pour les ids présents et complets ; les autres sont absents."""
+    content = response_text(response)
+    match = re.search(r"\[.*\]", content, re.DOTALL)
+
+    if not match:
+        raise ValueError("Réponse non-JSON")
+    entries = json.loads(match.group(0))
+    wanted = set(ids)
+    found = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        rid = str(entry.get("id"))
+        if rid not in wanted:
+            continue
+        try:
+            found[rid] = validate_result(entry)
+        except InvalidResponse:
+            pass  # Entrée relancée comme une entrée manquante
+    return found
+
+
+def split_cached(chunk, start, known=None):
+    """Résultats déjà connus du bloc (vide, cache, batch ingéré) + [(id, texte)] à demander."""
+    results, pending = [None] * len(chunk), []
+    for j, text in enumerate(chunk):
+        cached = None
+        if is_empty(text):
+            cached = empty_result()
+        elif known is not None and normalize_text(text) in known:
+            cached = known[normalize_text(text)]
+        elif _cache is not None:
+            cached = _cache.get(text)
+        if cached is not None:
+            results[j] = cached
+        else:
+            pending.append((str(start + j), text))
+    return results, pending
+
+
+def _store_batch(items, parsed, status="ok"):
+    results = {}
+    for rid, text in items:
+        if rid in parsed:
+            results[rid] = normalize_result(parsed[rid])
+            if _cache is not None:
+                _cache.put(text, results[rid])
+            results[rid][STATUS_COLUMN] = status
+    return results
+
+
+def _mark_retried(results):
+    for result in results.values():
+        if result[STATUS_COLUMN] == "ok":
+            result[STATUS_COLUMN] = "retried"
+    return results
+
+
+def _retry_split(items, results):
+    """Items à relancer : les manquants, ou les deux moitiés si tout le lot a échoué."""
+    missing = [item for item in items if item[0] not in results]
+    if missing:
+        spa_metrics.inc("llm_retries_total", len(missing), reason="batch")
+    if len(missing) == len(items):
+        half = len(items) // 2
+        return [items[:half], items[half:]]
+    return [missing] if missing else []
+
+
+def analyze_batch(items):
+    """[(id, texte)] -> {id: résultat}, en un seul prompt si possible.
+
+    Une erreur passagère (429, 5xx, réseau) relance le même lot après un
+    backoff. Si la réponse n'est pas valide ou qu'il manque des ids, le lot
+    est redécoupé et relancé ; un lot d'une seule description repasse par
+    le prompt unitaire habituel.
+    """
+    if not items:
+        return {}
+    if len(items) == 1:
+        rid, text = items[0]
+        return {rid: request_description(text)}
+
+    # Erreur passagère (429, 5xx, réseau) : même lot après un backoff ; réponse
+    # invalide ou ids manquants : le lot est redécoupé plus bas.
+    prompt = build_batch_prompt(items)
+    parsed = {}
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            spa_metrics.inc("llm_retries_total")
+        try:
+            response = create_response(**request_kwargs(prompt, structured=False))
+            parsed = parse_batch_response(response, [rid for rid, _ in items])
+        except Exception as e:
+            if is_retryable(e) and attempt < MAX_RETRIES:
+                time.sleep(backoff_delay(attempt))
+                continue
+            print(f"Erreur API ou parsing (lot de {len(items)}) : {e}")
+        break
+
+    results = _store_batch(items, parsed)
+    for retry_items in _retry_split(items, results):
+        results.update(_mark_retried(analyze_batch(retry_items)))
+    return results
+
+
+async def analyze_batch_async(aclient, items, bucket, semaphore, retries=MAX_RETRIES):
+    if not items:
+        return {}
+    if len(items) == 1:
+        rid, text = items[0]
+        return {rid: await request_description_async(aclient, text, bucket, semaphore, retries)}
+
+    ids = [rid for rid, _ in items]
+    try:
+        parsed, _ = await request_async(aclient, build_batch_prompt(items), bucket, semaphore,
+                                        lambda response: parse_batch_response(response, ids),
+                                        retries, structured=False)
+    except Exception as e:
+        print(f"Erreur API ou parsing (lot de {len(items)}) : {e}")
+        parsed = {}
+
+    results = _store_batch(items, parsed)
+    for retry_items in _retry_split(items, results):
+        results.update(_mark_retried(await analyze_batch_async(
+            aclient, retry_items, bucket, semaphore, retries)))
+    return results
+
 # ============================================================
-# TRAITEMENT AVEC SAUVEGARDE PROGRESSIVE
+# MODE BATCH HORS-LIGNE (fichier JSONL pour l'API Batch)
 # ============================================================
 
-results = []
 
-for i, desc in enumerate(tqdm(df["description"], desc="Analyse des descriptions")):
-    result = analyze_description(desc)
-    results.append(result)
+def write_batch_job(texts, path=BATCH_JOB_FILE, batch_size=BATCH_SIZE):
+    """Écrit une requête /v1/responses par bloc de descriptions non encore connues.
+
+    La correspondance custom_id -> (id, description) est gardée dans
+    `path.map.json` pour l'ingestion des résultats, qui ne dépend donc pas
+    de l'état du journal au moment où le job revient.
+    """
+    mapping = {}
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, len(texts), batch_size):
+            _, pending = split_cached(texts[start:start + batch_size], start)
+            if not pending:
+                continue
+            custom_id = f"req-{len(mapping)}"
+            mapping[custom_id] = [[rid, str(text)] for rid, text in pending]
+            if len(pending) == 1:
+                body = request_kwargs(build_prompt(pending[0][1]))
+            else:
+                body = request_kwargs(build_batch_prompt(pending), structured=False)
+            f.write(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": body,
+            }, ensure_ascii=False) + "\n")
+    with open(path + ".map.json", "w", encoding="utf-8") as f:
+        json.dump(mapping, f)
+    print(f"Fichier batch écrit : {path} ({len(mapping)} requêtes)")
+
+
+def ingest_batch_results(results_path, job_path=BATCH_JOB_FILE):
+    """Lit le fichier de résultats de l'API Batch -> {description normalisée: résultat}.
+
+    Les requêtes en erreur ou les ids manquants sont simplement absents :
+    ils seront analysés en ligne par le traitement normal.
+    """
+    with open(job_path + ".map.json", encoding="utf-8") as f:
+        mapping = json.load(f)
+
+    found = {}
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            items = mapping.get(entry.get("custom_id"), [])
+            ids = [rid for rid, _ in items]
+            response = entry.get("response") or {}
+            if not ids or response.get("status_code") != 200:
+                continue
+            try:
+                if len(ids) == 1:
+                    parsed = {ids[0]: parse_response(response["body"])}
+                else:
+                    parsed = parse_batch_response(response["body"], ids)
+            except Exception as e:
+                print(f"Erreur parsing batch {entry.get('custom_id')} : {e}")
+                continue
+            texts = dict(items)
+            for rid, result in _store_batch(items, parsed).items():
+                found[normalize_text(texts[rid])] = result
+    print(f"Résultats batch ingérés : {len(found)} descriptions")
+    return found
+
+# ============================================================
+# DÉDOUBLONNAGE DES DESCRIPTIONS
+# ============================================================
+
+
+def near_duplicate_fingerprint(text):
+    """Empreinte insensible à la ponctuation, aux accents et aux nombres.
+
+    Deux annonces republiées avec un âge ou une date mis à jour tombent sur
+    la même empreinte. L'ordre des mots est conservé : "avec les chats mais
+    pas avec les chiens" et l'inverse restent distinctes, tout comme des
+    annonces qui diffèrent par un mot (nom de l'animal compris).
+    """
+    text = unicodedata.normalize("NFD", normalize_text(text))
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return " ".join(re.findall(r"[a-z]+", text))
+
+
+def dedupe_descriptions(texts, near_duplicates=False):
+    """Regroupe les descriptions identiques (après normalisation).
+
+    Retourne (représentants, groupe de chaque ligne). Les groupes sont
+    numérotés dans l'ordre de première apparition : le représentant du
+    groupe k est la première ligne du groupe.
+    """
+    key_of = near_duplicate_fingerprint if near_duplicates else normalize_text
+    group_ids, representatives, groups = {}, [], []
+    for text in texts:
+        key = "" if is_empty(text) else key_of(text)
+        if key not in group_ids:
+            group_ids[key] = len(representatives)
+            representatives.append(text)
+        groups.append(group_ids[key])
+    return representatives, groups
+
+# ============================================================
+# JOURNAL DE REPRISE (append-only)
+# ============================================================
+
+
+def row_keys(df):
+    """Identifiant stable de chaque ligne : l'id de l'animal s'il est unique,
+    sinon l'index (la position, ou la position globale d'un morceau de fichier)."""
+    if "id" in df.columns and df["id"].notna().all() and df["id"].is_unique:
+        return df["id"].astype(str).tolist()
+    return [str(i) for i in df.index]
+
+
+def journal_signatures(texts):
+    """Ce qui détermine le résultat de chaque ligne : description normalisée,
+    backend, modèle et version du prompt. Une entrée de journal dont la
+    signature diffère (description modifiée, autre backend...) est périmée."""
+    context = "\x1f".join([BACKEND, MODEL, prompt_version()])
+    return [hashlib.sha256(f"{'' if is_empty(t) else normalize_text(t)}\x1f{context}".encode("utf-8"))
+            .hexdigest()[:16] for t in texts]
+
+
+class Journal:
+    """Une ligne JSON {"row": id, "sig": signature, "result": {...}} par ligne terminée.
+
+    Chaque ligne terminée coûte un append (O(1)), au lieu de réécrire tout
+    le CSV. À la reprise, seules les lignes journalisées avec la même
+    signature (voir journal_signatures) sont sautées ; une dernière ligne
+    tronquée par un crash est ignorée.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.done = {}
+        self.signatures = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.done[entry["row"]] = entry["result"]
+                    self.signatures[entry["row"]] = entry.get("sig")
+        except FileNotFoundError:
+            pass
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")  # Isoler la ligne tronquée
+        self._unsynced = 0
+
+    def is_done(self, row, sig):
+        return row in self.done and self.signatures.get(row) == sig
+
+    def append(self, row, result, sig=None):
+        self.done[row] = result
+        self.signatures[row] = sig
+        self._file.write(json.dumps({"row": row, "sig": sig, "result": result},
+                                    ensure_ascii=False) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= SAVE_INTERVAL:
+            self.sync()
+
+    def release(self, rows):
+        """Oublie en mémoire des lignes déjà rendues (le fichier les garde pour
+        la reprise) : en streaming, seule la page en cours reste en mémoire."""
+        for row in rows:
+            self.done.pop(row, None)
+            self.signatures.pop(row, None)
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+# ============================================================
+# TRAITEMENT AVEC REPRISE
+# ============================================================
+
+
+def load_input(input_file=INPUT_FILE):
+    df = spa_io.read_table(input_file)
+    if "description" not in df.columns:
+        raise ValueError("La colonne 'description' est manquante dans ton fichier CSV.")
+    return df
+
+
+def prepare_retry_failed(journal, previous_output=None):
+    """Ne relance que les lignes en échec.
+
+    Les lignes "failed" du journal sont retirées de `journal.done` (elles
+    seront retraitées et la nouvelle entrée, ajoutée après, fait foi). Si un
+    fichier de sortie précédent est fourni, ses lignes réussies sont reprises
+    dans le journal, ce qui permet de réparer un CSV dont le journal a été
+    supprimé.
+    """
+    if previous_output:
+        previous = spa_io.read_table(previous_output,
+                                     columns=["id", "description", *KEYWORD_COLUMNS, STATUS_COLUMN])
+        sigs = journal_signatures(previous["description"]) if "description" in previous.columns \
+            else [None] * len(previous)
+        for key, sig, row in zip(row_keys(previous), sigs, previous.to_dict("records")):
+            status = row.get(STATUS_COLUMN, "ok")
+            if status != "failed" and key not in journal.done:
+                result = {col: spa_io.parse_list_cell(row.get(col)) for col in KEYWORD_COLUMNS}
+                result[STATUS_COLUMN] = status if isinstance(status, str) else "ok"
+                journal.append(key, result, sig)
+            elif status == "failed" and key in journal.done:
+                journal.done[key][STATUS_COLUMN] = "failed"
+
+    failed = [key for key, result in journal.done.items()
+              if result.get(STATUS_COLUMN) == "failed"]
+    for key in failed:
+        del journal.done[key]
+    print(f"Relance des lignes en échec : {len(failed)}")
+
+
+def analyze_all(representatives, batch_size=BATCH_SIZE, known=None, on_result=None):
+    results = []
+
+    starts = range(0, len(representatives), batch_size)
+    for start in tqdm(starts, desc="Analyse des descriptions", disable=not PROGRESS):
+        chunk_results, pending = split_cached(
+            representatives[start:start + batch_size], start, known)
+        for rid, result in analyze_batch(pending).items():
+            chunk_results[int(rid) - start] = result
+        results.extend(chunk_results)
+        if on_result is not None:
+            for j, result in enumerate(chunk_results):
+                on_result(start + j, result)
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extraction de mots-clés par LLM")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--journal", default=JOURNAL_FILE,
+                        help="journal de reprise (une ligne par ligne terminée)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=BACKEND,
+                        help="openai, local (hors-ligne) ou hybrid (API seulement si doute)")
+    parser.add_argument("--hybrid-threshold", type=float, default=HYBRID_THRESHOLD)
+    parser.add_argument("--base-url", default=BASE_URL,
+                        help="endpoint compatible Responses API (ex. stub local)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="N requêtes en vol avec ordonnancement token-bucket")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=RPM_LIMIT)
+    parser.add_argument("--tpm", type=float, default=TPM_LIMIT)
+    parser.add_argument("--cache", default=CACHE_FILE, help="cache SQLite des réponses")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="nouvelles tentatives par description (backoff + réparation)")
+    parser.add_argument("--retry-failed", nargs="?", const=True, default=None, metavar="CSV",
+                        help="ne relance que les lignes en échec (du journal, ou d'un CSV de sortie)")
+    parser.add_argument("--list-format", choices=["repr", "json"], default=LIST_FORMAT,
+                        help="encodage des listes dans le CSV de sortie")
+    parser.add_argument("--no-structured-output", action="store_true",
+                        help="pour les endpoints qui ne gèrent pas text.format json_schema")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="regroupe aussi les descriptions quasi identiques")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="nombre de descriptions par prompt")
+    parser.add_argument("--write-batch-job", nargs="?", const=BATCH_JOB_FILE, default=None,
+                        metavar="JSONL", help="écrit un fichier de requêtes pour l'API Batch")
+    parser.add_argument("--ingest-batch-results", default=None, metavar="JSONL",
+                        help="reprend les résultats d'un job Batch (fichier de sortie)")
+    parser.add_argument("--batch-job", default=BATCH_JOB_FILE,
+                        help="fichier de requêtes correspondant à --ingest-batch-results")
+    spa_metrics.add_arguments(parser, "2_api")
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    """Applique les options de la ligne de commande aux réglages du module."""
+    global BACKEND, BASE_URL, HYBRID_THRESHOLD, MAX_RETRIES, STRUCTURED_OUTPUT, _cache
+    MAX_RETRIES = args.retries
+    STRUCTURED_OUTPUT = not args.no_structured_output
+    BACKEND = args.backend
+    BASE_URL = args.base_url
+    HYBRID_THRESHOLD = args.hybrid_threshold
+    if not args.no_cache and BACKEND != "local":
+        _cache = KeywordCache(args.cache)
+
+
+def close_cache():
+    global _cache
+    if _cache is not None:
+        print(_cache.stats())
+        _cache.close()
+        _cache = None
+
+
+def process_frame(df, args, journal=None, session=None):
+    """df + les 5 colonnes de listes (vraies listes Python) + status.
+
+    Reprend depuis args.journal (ou `journal`, déjà ouvert et laissé ouvert,
+    quand l'appelant traite plusieurs morceaux à la suite ; `session`, une
+    AsyncSession, sert alors pour --async) ; renvoie None si seul un fichier
+    de requêtes batch a été écrit (--write-batch-job).
+    """
+    with spa_metrics.stage("api") as stage:
+        stage.rows = len(df)
+        return _process_frame(df, args, journal, session)
+
+
+def _process_frame(df, args, journal, session=None):
+    keys = row_keys(df)
+    own_journal = journal is None
+    if own_journal:
+        journal = Journal(args.journal)
+    if args.retry_failed:
+        prepare_retry_failed(journal, None if args.retry_failed is True else args.retry_failed)
+    sigs = journal_signatures(df["description"])
+    todo = [i for i, key in enumerate(keys) if not journal.is_done(key, sigs[i])]
+    if len(todo) < len(keys) and PROGRESS:
+        print(f"Reprise depuis {args.journal} : {len(keys) - len(todo)} lignes déjà traitées")
+
+    texts = df["description"].iloc[todo]
+    representatives, groups = dedupe_descriptions(texts, args.near_duplicates)
+    members = [[] for _ in representatives]
+    for i, g in zip(todo, groups):
+        members[g].append((keys[i], sigs[i]))
+    n_rows = sum(not is_empty(t) for t in texts)
+    n_calls = sum(not is_empty(t) for t in representatives)
+    if PROGRESS:
+        print(f"{n_rows} descriptions, {n_calls} uniques : "
+              f"{n_rows - n_calls} appels API économisés")
+
+    batch_size = max(1, args.batch_size)
+    if args.write_batch_job:
+        write_batch_job(representatives, args.write_batch_job, batch_size)
+        if own_journal:
+            journal.close()
+        return None
+    known = None
+    if args.ingest_batch_results:
+        known = ingest_batch_results(args.ingest_batch_results, args.batch_job)
+
+    def on_result(g, result):
+        for key, sig in members[g]:
+            journal.append(key, result, sig)
+
+    # Backend local / hybride : tout passe d'abord par l'extracteur hors-ligne,
+    # seules les descriptions où il doute (hybride) partent vers l'API.
+    remote = list(range(len(representatives)))
+    if BACKEND in ("local", "hybrid"):
+        remote = []
+        for g, text in enumerate(tqdm(representatives, desc="Extraction locale",
+                                      disable=not PROGRESS)):
+            result, confidence = extract_keywords_local_scored(text)
+            if BACKEND == "local" or confidence >= HYBRID_THRESHOLD:
+                on_result(g, result)
+            else:
+                remote.append(g)
+        if BACKEND == "hybrid" and PROGRESS:
+            print(f"Hybride : {len(remote)} descriptions envoyées à l'API")
+
+    remote_texts = [representatives[g] for g in remote]
+
+    def on_remote_result(j, result):
+        on_result(remote[j], result)
+
+    try:
+        if remote and args.use_async:
+            coro = analyze_all_async(
+                remote_texts, args.concurrency, args.rpm, args.tpm, args.retries,
+                batch_size=batch_size, known=known, on_result=on_remote_result, session=session)
+            if session is not None:
+                session.run(coro)
+            else:
+                asyncio.run(coro)
+        elif remote:
+            analyze_all(remote_texts, batch_size, known, on_remote_result)
+    finally:
+        if own_journal:
+            journal.close()
+
+    # Construction unique du résultat depuis le journal
+    structured_df = pd.json_normalize([journal.done[key] for key in keys])
+    structured_df.index = df.index
+    if PROGRESS:
+        print("Statuts :", structured_df[STATUS_COLUMN].value_counts().to_dict())
+    return pd.concat([df, structured_df], axis=1)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    tqdm.pandas()
 
-    # Sauvegarde partielle régulière
-    if (i + 1) % SAVE_INTERVAL == 0:
-        temp_df = pd.concat([df.iloc[:i+1], pd.json_normalize(results)], axis=1)
-        temp_df.to_csv(OUTPUT_FILE, index=False)
-        print(f"Sauvegarde intermédiaire à {i+1} lignes")
+    with spa_metrics.session(args):
+        df_final = process_frame(load_input(args.input), args)
+        if df_final is not None:
+            if args.list_format == "json" and not spa_io.is_parquet(args.output):
+                for col in KEYWORD_COLUMNS:
+                    df_final[col] = df_final[col].map(lambda v: json.dumps(v, ensure_ascii=False))
+            spa_io.write_table(df_final, args.output)
+            print(f"Traitement terminé et fichier sauvegardé : {args.output}")
+        close_cache()
 
-# Fusion finale et export complet
-structured_df = pd.json_normalize(results)
-df_final = pd.concat([df, structured_df], axis=1)
-df_final.to_csv(OUTPUT_FILE, index=False)
 
-print(f"Traitement terminé et fichier sauvegardé : {OUTPUT_FILE}")
+if __name__ == "__main__":
+    main()
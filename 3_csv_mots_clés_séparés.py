@@ -1,16 +1,20 @@
+import argparse
+import json
+import time
+import numpy as np
 import pandas as pd
-import ast
 from tqdm import tqdm
+import spa_io
+import spa_metrics
 
 # ==========================
-# 1️⃣ Chargement du fichier
+# 1️⃣ Fichiers
 # ==========================
 INPUT_FILE = "animaux_spa_key_words.csv"
 OUTPUT_FILE = "animaux_spa_expanded.csv"
-
-tqdm.pandas()
-df = pd.read_csv(INPUT_FILE, dtype=str, encoding="utf-8")
-print(f"📦 {df.shape[0]} lignes chargées.")
+# Format normalisé (--format long) : une table animaux + une table de mots-clés
+ANIMALS_FILE = "animaux_spa_animals.csv"
+KEYWORDS_LONG_FILE = "animaux_spa_keywords_long.csv"
 
 # ==========================
 # 2️⃣ Colonnes contenant des listes
@@ -26,60 +30,282 @@ list_cols = [
 # ==========================
 # 3️⃣ Convertir les chaînes en vraies listes Python
 # ==========================
+# Cellule par cellule : spa_io.parse_list_cell (partagé avec 2_api_csv.py).
+
+# Listes "simples" : chaînes sans guillemet ni échappement, séparées par ", ".
+# C'est ce qu'écrit 2_api_csv.py dans l'immense majorité des cellules, au
+# format repr Python ('...') comme au format JSON ("...").
+SIMPLE_LIST_PATTERNS = {
+    q: rf"\[{q}[^{q}\\]*{q}(?:, {q}[^{q}\\]*{q})*\]" for q in ("'", '"')
+}
+
+
+def parse_list_column(col):
+    """Même résultat que col.map(spa_io.to_list), mais sur la colonne entière.
 
+    Les cellules vides et les listes simples sont découpées par les
+    opérations de chaînes vectorisées de pandas ; seules les cellules
+    atypiques (guillemets internes, échappements, texte mal formé) passent
+    par spa_io.parse_list_cell.
+    """
+    s = col.astype("string").str.strip()
+    out = [None] * len(s)
+    todo = np.ones(len(s), dtype=bool)
 
-def to_list(x):
-    if pd.isna(x):
-        return []
-    if isinstance(x, list):
-        return x
-    s = str(x).strip()
-    if not s or s.lower() in ["nan", "none"]:
-        return []
-    try:
-        val = ast.literal_eval(s)
-        if isinstance(val, list):
-            return val
-        else:
-            return [val]
-    except Exception:
-        cleaned = s.replace("[", "").replace("]", "").replace("'", "")
-        return [v.strip() for v in cleaned.split(",") if v.strip()]
-
-
-for col in list_cols:
-    df[col] = df[col].progress_apply(to_list)
+    empty = (s.isna() | s.isin(["", "[]"]) | s.str.lower().isin(["nan", "none"])).to_numpy(dtype=bool)
+    for i in np.flatnonzero(empty):
+        out[i] = []
+    todo &= ~empty
+
+    for q, pattern in SIMPLE_LIST_PATTERNS.items():
+        simple = todo & s.str.fullmatch(pattern).fillna(False).to_numpy(dtype=bool)
+        items = s[simple].str.slice(2, -2).str.split(f"{q}, {q}", regex=False)
+        for i, value in zip(np.flatnonzero(simple), items.tolist()):
+            out[i] = value
+        todo &= ~simple
+
+    values = col.to_numpy(dtype=object)
+    for i in np.flatnonzero(todo):
+        out[i] = spa_io.parse_list_cell(values[i])
+    return pd.Series(out, index=col.index, dtype=object)
 
 # ==========================
 # 4️⃣ Expansion des lignes
 # ==========================
-expanded_rows = []
 
-for _, row in tqdm(df.iterrows(), total=len(df), desc="🔄 Expansion des listes"):
-    # Trouver la longueur max parmi les colonnes à liste
-    max_len = max(len(row[col]) for col in list_cols)
-    if max_len == 0:
-        expanded_rows.append(row.to_dict())
-        continue
 
-    for i in range(max_len):
-        new_row = row.copy()
+def expand_lists(df):
+    """Une ligne par position de mot-clé, les 5 listes alignées par position.
+
+    Chaque ligne d'entrée est répétée max(len(listes)) fois (1 fois si
+    toutes les listes sont vides) par répétition d'index, puis chaque
+    colonne `*_separated` est remplie d'un seul coup : élément i de la liste
+    pour la i-ème copie, None au-delà de sa longueur.
+    """
+    with spa_metrics.stage("separation") as stage:
+        stage.rows = len(df)
+        return _expand_lists(df)
+
+
+def _expand_lists(df):
+    lengths = np.column_stack([df[col].map(len).to_numpy(dtype=np.int64) for col in list_cols])
+    reps = np.maximum(lengths.max(axis=1), 1)
+    row_idx = np.repeat(np.arange(len(df)), reps)
+    # Position de chaque ligne de sortie dans son groupe : 0, 1, 2... puis 0, 1...
+    starts = np.cumsum(reps) - reps
+    pos = np.arange(len(row_idx)) - np.repeat(starts, reps)
+
+    df_expanded = df.drop(columns=list_cols).iloc[row_idx].reset_index(drop=True)
+
+    for k, col in enumerate(list_cols):
+        col_len = lengths[:, k]
+        flat = np.empty(int(col_len.sum()), dtype=object)
+        flat[:] = [item for items in df[col] for item in items]
+        offsets = np.cumsum(col_len) - col_len
+
+        values = np.full(len(row_idx), None, dtype=object)
+        present = pos < col_len[row_idx]
+        values[present] = flat[offsets[row_idx[present]] + pos[present]]
+        df_expanded[f"{col}_separated"] = values
+
+    return df_expanded
+
+
+def expand_lists_iterrows(df):
+    """Ancienne expansion ligne à ligne, gardée comme référence pour le benchmark."""
+    expanded_rows = []
+
+    for _, row in tqdm(df.iterrows(), total=len(df), desc="🔄 Expansion des listes"):
+        # Trouver la longueur max parmi les colonnes à liste
+        max_len = max(len(row[col]) for col in list_cols)
+        if max_len == 0:
+            expanded_rows.append(row.to_dict())
+            continue
+
+        for i in range(max_len):
+            new_row = row.copy()
+            for col in list_cols:
+                items = row[col]
+                new_row[f"{col}_separated"] = items[i] if i < len(items) else None
+            expanded_rows.append(new_row.to_dict())
+
+    df_expanded = pd.DataFrame(expanded_rows)
+    df_expanded.drop(columns=list_cols, inplace=True)
+    return df_expanded
+
+# ==========================
+# 5️⃣ Format long (normalisé)
+# ==========================
+
+
+def animal_ids(df):
+    """Clé de jointure : l'id de l'animal s'il est unique, sinon la position."""
+    if "id" in df.columns and df["id"].notna().all() and df["id"].is_unique:
+        return df["id"].to_numpy()
+    return np.arange(len(df))
+
+
+def to_long(df):
+    """(animaux, mots-clés) : les colonnes larges une seule fois par animal,
+    et une ligne (animal_id, family, position, keyword) par mot-clé.
+
+    La taille ne dépend plus que du nombre de mots-clés, au lieu de
+    répéter toute la ligne (description comprise) pour chaque position.
+    """
+    ids = animal_ids(df)
+    animals = df.drop(columns=list_cols)
+    animals.insert(0, "animal_id", ids)
+
+    parts = []
+    for col in list_cols:
+        lengths = df[col].map(len).to_numpy(dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        keywords = np.empty(int(lengths.sum()), dtype=object)
+        keywords[:] = [item for items in df[col] for item in items]
+        parts.append(pd.DataFrame({
+            "animal_id": np.repeat(ids, lengths),
+            "family": col,
+            "position": np.arange(len(keywords)) - np.repeat(starts, lengths),
+            "keyword": keywords,
+        }))
+    return animals, pd.concat(parts, ignore_index=True)
+
+
+def join_wide(animals, long, columns=None):
+    """Reconstruit le format élargi à la demande à partir du format long.
+
+    `columns` associe chaque colonne de valeurs de la table longue au nom
+    de colonne large, formaté avec la famille (par défaut keyword ->
+    `{family}_separated`, soit exactement la sortie de expand_lists).
+    """
+    columns = columns or {"keyword": "{family}_separated"}
+    wide = long.set_index(["animal_id", "position", "family"])[list(columns)].unstack("family")
+    wide.columns = [columns[value].format(family=family) for value, family in wide.columns]
+    for value, pattern in columns.items():
         for col in list_cols:
-            items = row[col]
-            new_row[f"{col}_separated"] = items[i] if i < len(items) else None
-        expanded_rows.append(new_row.to_dict())
+            name = pattern.format(family=col)
+            if name not in wide.columns:
+                wide[name] = None
+    ordered = [pattern.format(family=col) for pattern in columns.values() for col in list_cols]
+    wide = wide[ordered].reset_index().sort_values(["animal_id", "position"], kind="stable")
 
-# Créer le DataFrame final
-df_expanded = pd.DataFrame(expanded_rows)
+    # Jointure à gauche : ordre des animaux conservé, une ligne vide si aucun mot-clé
+    joined = animals.merge(wide, on="animal_id", how="left", sort=False)
+    return joined.drop(columns=["animal_id", "position"])
 
 # ==========================
-# 5️⃣ Supprimer les colonnes *_keywords originales
+# 6️⃣ Benchmark
 # ==========================
-df_expanded.drop(columns=list_cols, inplace=True)
+
+LEGACY_BENCH_MAX = 20_000  # Au-delà, l'ancienne version est extrapolée (trop lente)
+
+
+def synthetic_frame(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vocab = np.array(["calme", "joueur", "craintif", "vacciné", "stérilisé", "jardin",
+                      "chats_ok", "chiens_non", "enfants_oui", "déménagement"], dtype=object)
+    df = pd.DataFrame({"id": np.arange(n), "name": "animal", "description": "texte"})
+    for col in list_cols:
+        sizes = rng.integers(0, 5, n)
+        words = vocab[rng.integers(0, len(vocab), int(sizes.sum()))].tolist()
+        cuts = np.cumsum(sizes)[:-1]
+        df[col] = [list(part) for part in np.split(np.array(words, dtype=object), cuts)]
+    return df
+
+
+def benchmark_parse(df, n):
+    """Parseur vectorisé contre literal_eval, cellule par cellule, sur les 5 colonnes."""
+    for fmt, dump in (("repr", str), ("json", lambda v: json.dumps(v, ensure_ascii=False))):
+        cells = {col: df[col].map(dump).astype(str) for col in list_cols}
+        start = time.perf_counter()
+        fast = {col: parse_list_column(cells[col]) for col in list_cols}
+        t_fast = time.perf_counter() - start
+
+        sample = min(n, LEGACY_BENCH_MAX)
+        start = time.perf_counter()
+        legacy = {col: cells[col].iloc[:sample].map(spa_io.to_list) for col in list_cols}
+        t_legacy = (time.perf_counter() - start) * n / sample
+        same = all(fast[col].iloc[:sample].tolist() == legacy[col].tolist() for col in list_cols)
+
+        note = "" if sample == n else f" (extrapolé depuis {sample} lignes)"
+        print(f"{n:>9} lignes, parsing {fmt:<4} : vectorisé {t_fast:7.2f}s, "
+              f"literal_eval {t_legacy:8.2f}s{note}, x{t_legacy / t_fast:.0f}, identique={same}")
+
+
+def benchmark(sizes):
+    for n in sizes:
+        df = synthetic_frame(n)
+        start = time.perf_counter()
+        fast = expand_lists(df)
+        t_fast = time.perf_counter() - start
+
+        sample = df if n <= LEGACY_BENCH_MAX else df.iloc[:LEGACY_BENCH_MAX]
+        start = time.perf_counter()
+        legacy = expand_lists_iterrows(sample)
+        t_legacy = (time.perf_counter() - start) * n / len(sample)
+        same = legacy.equals(expand_lists(sample)[legacy.columns])
+
+        note = "" if len(sample) == n else f" (extrapolé depuis {len(sample)} lignes)"
+        print(f"{n:>9} lignes -> {len(fast):>9} : vectorisé {t_fast:7.2f}s, "
+              f"iterrows {t_legacy:8.2f}s{note}, x{t_legacy / t_fast:.0f}, identique={same}")
+        benchmark_parse(df, n)
 
 # ==========================
-# 6️⃣ Sauvegarde
+# 7️⃣ Exécution
 # ==========================
-df_expanded.to_csv(OUTPUT_FILE, index=False, encoding="utf-8")
-print(f"✅ Fichier exporté : {OUTPUT_FILE}")
-print(f"📊 Nombre total de lignes : {len(df_expanded)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Séparation des listes de mots-clés")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--format", choices=["wide", "long"], default="wide",
+                        help="wide : une ligne par position (historique) ; "
+                             "long : table animaux + table de mots-clés")
+    parser.add_argument("--animals-output", default=ANIMALS_FILE)
+    parser.add_argument("--keywords-output", default=KEYWORDS_LONG_FILE)
+    parser.add_argument("--benchmark", nargs="*", type=int, metavar="N",
+                        help="compare les deux moteurs d'expansion sur N lignes synthétiques")
+    spa_metrics.add_arguments(parser, "3_separation")
+    args = parser.parse_args(argv)
+
+    if args.benchmark is not None:
+        benchmark(args.benchmark or [10_000, 1_000_000])
+        return
+
+    with spa_metrics.session(args):
+        run(args)
+
+
+def run(args):
+    df = spa_io.read_table(args.input, dtype=str, encoding="utf-8")
+    print(f"📦 {df.shape[0]} lignes chargées.")
+
+    # En Parquet, les listes sont déjà natives : seul le CSV demande un parsing
+    if not spa_io.is_parquet(args.input):
+        with spa_metrics.timer("list_parse_seconds_total"):
+            for col in tqdm(list_cols, desc="🔄 Lecture des listes"):
+                df[col] = parse_list_column(df[col])
+
+    if args.format == "long":
+        with spa_metrics.stage("separation") as stage:
+            animals, keywords = to_long(df)
+            stage.rows = len(df)
+        spa_io.write_table(animals, args.animals_output, encoding="utf-8")
+        spa_io.write_table(keywords, args.keywords_output, encoding="utf-8")
+        print(f"✅ Fichiers exportés : {args.animals_output} ({len(animals)} animaux), "
+              f"{args.keywords_output} ({len(keywords)} mots-clés)")
+        return
+
+    df_expanded = expand_lists(df)
+
+    # ==========================
+    # Sauvegarde
+    # ==========================
+    spa_io.write_table(df_expanded, args.output, encoding="utf-8")
+    print(f"✅ Fichier exporté : {args.output}")
+    print(f"📊 Nombre total de lignes : {len(df_expanded)}")
+
+
+if __name__ == "__main__":
+    main()
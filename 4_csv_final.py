@@ -1,8 +1,20 @@
+import argparse
+import hashlib
+import importlib
+import json
 import os
+import random
 import re
+import sqlite3
 import sys
+import time
 import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import spa_io
+import spa_metrics
 
 # -----------------------------
 # Étape 0. Définir les fichiers I/O
@@ -11,13 +23,26 @@ import pandas as pd
 INPUT_CSV = "animaux_spa_expanded.csv"
 # Fichier de sortie (résultat)
 OUTPUT_CSV = "animaux_spa_VERSION_FINALE_ZERO_RESTE.csv"
+# Format long (--format long) : tables produites par l'étape 3 avec --format long
+ANIMALS_CSV = "animaux_spa_animals.csv"
+KEYWORDS_LONG_CSV = "animaux_spa_keywords_long.csv"
+# Sortie longue : une catégorie par mot-clé (animal_id, family, position, keyword, category)
+CATEGORIES_LONG_CSV = "animaux_spa_categories_long.csv"
+# Cache persistant token -> catégorie, versionné par table de règles
+CACHE_FILE = "animaux_spa_categories_cache.sqlite"
+# Classifieur flou (--fuzzy) pour les cellules qu'aucune règle ne reconnaît
+FUZZY_THRESHOLD = 0.3   # Similarité cosinus minimale au centroïde, sinon catégorie par défaut
+FUZZY_NGRAM = 3
+FUZZY_DIM = 1 << 18     # Taille de l'espace de hachage des n-grammes
+FUZZY_MAX_LEN = 40      # Les tokens plus longs sont tronqués
 
 # --------------------------------
 # Étape 1. Normalisation du texte
 # --------------------------------
 
 
-def norm(s: str) -> str:
+def norm_naive(s: str) -> str:
+    """Normalisation d'origine, gardée comme référence pour --self-check."""
     if s is None:
         return ""
     s = str(s).strip().lower()
@@ -27,6 +52,36 @@ def norm(s: str) -> str:
     s = re.sub(r"\s+", "_", s).strip("_")
     return s
 
+
+KEEP_CHAR = re.compile(r"[a-z0-9_/\+'\s]")
+WHITESPACE = re.compile(r"\s+")
+
+
+class _NormTable(dict):
+    """Table de str.translate remplie à la demande : chaque caractère est
+    décomposé (accents retirés), remplacé puis filtré une seule fois, et le
+    résultat est réutilisé pour toutes les cellules suivantes."""
+
+    def __missing__(self, code):
+        out = []
+        for c in unicodedata.normalize("NFD", chr(code)):
+            if unicodedata.category(c) == "Mn":
+                continue
+            c = {"-": "_", "’": "'", "“": "\"", "”": "\""}.get(c, c)
+            out.append(c if KEEP_CHAR.fullmatch(c) else " ")
+        self[code] = "".join(out)
+        return self[code]
+
+
+NORM_TABLE = _NormTable()
+
+
+def norm(s: str) -> str:
+    if s is None:
+        return ""
+    s = str(s).strip().lower().translate(NORM_TABLE)
+    return WHITESPACE.sub("_", s).strip("_")
+
 # -----------------------------------
 # Étape 2. Tokenisation des cellules
 # -----------------------------------
@@ -58,6 +113,71 @@ def split_tokens(cell: str):
 def any_substr(token_or_joined, substrings):
     return any(sub in token_or_joined for sub in substrings)
 
+
+def first_rule_naive(text, rules):
+    """Première règle (ordre de priorité) dont une sous-chaîne apparaît dans text."""
+    for cat, rule in rules:
+        if any_substr(text, rule["substr"]):
+            return cat
+    return None
+
+
+def _trie_regex(patterns):
+    """Alternative factorisée en arbre de préfixes : à chaque position, un seul
+    chemin est suivi, et les quantificateurs gloutons renvoient le motif le
+    plus long."""
+    children = {}
+    terminal = False
+    for p in patterns:
+        if p:
+            children.setdefault(p[0], []).append(p[1:])
+        else:
+            terminal = True
+    if not children:
+        return ""
+    body = "|".join(re.escape(c) + _trie_regex(rest) for c, rest in sorted(children.items()))
+    return f"(?:{body})" + ("?" if terminal else "")
+
+
+class RuleMatcher:
+    """Table de règles compilée une fois en une seule regex.
+
+    Les sous-chaînes de toutes les règles forment une alternative, essayée
+    à chaque position du texte (lookahead, donc chevauchements compris) sous
+    forme d'arbre de préfixes : à une position donnée, on obtient le motif
+    le plus long, et tous les autres motifs présents à cette position en
+    sont des préfixes. `best` donne pour chaque motif la
+    règle la plus prioritaire parmi lui et ses préfixes ; le minimum sur
+    les positions est exactement la règle que trouverait first_rule_naive.
+    """
+
+    def __init__(self, rules):
+        self.categories = [cat for cat, _ in rules]
+        rank = {}
+        for i, (_, rule) in enumerate(rules):
+            for sub in rule["substr"]:
+                rank.setdefault(sub, i)
+        self.best = {p: min(r for q, r in rank.items() if p.startswith(q)) for p in rank}
+        self.regex = re.compile("(?=(" + _trie_regex(sorted(rank)) + "))")
+        # Résultats déjà calculés (texte -> catégorie), et ceux pas encore mis en cache
+        self.memo = {}
+        self.fresh = []
+
+    def first(self, text):
+        if text in self.memo:
+            return self.memo[text]
+        best = None
+        for m in self.regex.finditer(text):
+            r = self.best[m.group(1)]
+            if best is None or r < best:
+                best = r
+                if r == 0:
+                    break
+        cat = None if best is None else self.categories[best]
+        self.memo[text] = cat
+        self.fresh.append(text)
+        return cat
+
 # ------------------------------------------------
 # Étape 4. Règles de catégorisation - BEHAVIOR
 # ------------------------------------------------
@@ -120,11 +240,14 @@ BEHAVIOR_RULES = [
 ]
 
 
+BEHAVIOR_MATCHER = RuleMatcher(BEHAVIOR_RULES)
+
+
 def map_behavior_category(toks):
     for t in toks:
-        for cat, rule in BEHAVIOR_RULES:
-            if any_substr(t, rule["substr"]):
-                return cat
+        cat = BEHAVIOR_MATCHER.first(t)
+        if cat:
+            return cat
     return "Besoin d'éducation/Patience" if toks else ""
 
 # ------------------------------------------------
@@ -209,11 +332,14 @@ HEALTH_RULES = [
 ]
 
 
+HEALTH_MATCHER = RuleMatcher(HEALTH_RULES)
+
+
 def map_health_category(toks):
     for t in toks:
-        for cat, rule in HEALTH_RULES:
-            if any_substr(t, rule["substr"]):
-                return cat
+        cat = HEALTH_MATCHER.first(t)
+        if cat:
+            return cat
     return "Statut Incertain/Suivi" if toks else ""
 
 # ------------------------------------------------
@@ -276,50 +402,46 @@ ADOPT_RULES = [
 ]
 
 
-def adoption_fallback(toks):
-    if not toks:
-        return ""
-    joined = " ".join(toks)
-
-    if any_substr(joined, [
+# Repli sur l'ensemble des tokens joints, testé dans cet ordre
+ADOPT_FALLBACK_RULES = [
+    ("Doit être Seul Animal", dict(substr=[
         "seul", "exclusif", "sans_autres", "seule", "exclusivite", "seul_animal"
-    ]):
-        return "Doit être Seul Animal"
-
-    if any_substr(joined, [
+    ])),
+    ("Environnement Calme & Stable", dict(substr=[
         "calme", "confiance", "temps", "rencontre", "environnement", "stabil",
         "seren", "douceur", "stabilite", "tranquil", "serenite", "rassurer",
         "securis", "securite"
-    ]):
-        return "Environnement Calme & Stable"
-
-    if any_substr(joined, [
+    ])),
+    ("Adoptant Expérimenté/Patient", dict(substr=[
         "experimen", "educateur", "connaiss", "patient", "guidance",
         "suivi", "reflexion", "responsable"
-    ]):
-        return "Adoptant Expérimenté/Patient"
-
-    if any_substr(joined, [
+    ])),
+    ("Besoin de Présence Humaine", dict(substr=[
         "presence", "present", "compagnie", "contact", "famille", "pas_seul",
         "solitude", "attention", "proche", "humain", "ronron", "ami", "compagnon"
-    ]):
-        return "Besoin de Présence Humaine"
-
-    if any_substr(joined, [
+    ])),
+    ("Besoin d'Extérieur/Jardin", dict(substr=[
         "jardin", "exter", "exterieur", "acces_exterieur", "plein_pied", "terrain",
         "balade", "promenade", "semi_liberte", "liberte", "enclos", "campagne",
         "sortie", "verdure", "balcon"
-    ]):
-        return "Besoin d'Extérieur/Jardin"
+    ])),
+]
 
-    return "Environnement Calme & Stable"
+ADOPT_MATCHER = RuleMatcher(ADOPT_RULES)
+ADOPT_FALLBACK_MATCHER = RuleMatcher(ADOPT_FALLBACK_RULES)
+
+
+def adoption_fallback(toks):
+    if not toks:
+        return ""
+    return ADOPT_FALLBACK_MATCHER.first(" ".join(toks)) or "Environnement Calme & Stable"
 
 
 def map_adoption_category(toks):
     for t in toks:
-        for cat, rule in ADOPT_RULES:
-            if any_substr(t, rule["substr"]):
-                return cat
+        cat = ADOPT_MATCHER.first(t)
+        if cat:
+            return cat
     return adoption_fallback(toks)
 
 
@@ -348,21 +470,369 @@ def map_compatibility_norm(toks):
     return ";".join(sorted(tags))
 
 # -------------------------------------------
-# Étape 8. Exécution globale
+# Étape 6 bis. Catégorisation d'une colonne, une fois par valeur distincte
 # -------------------------------------------
 
 
-def main():
-    # 8.1 Lecture du CSV source
-    src = INPUT_CSV
-    dst = OUTPUT_CSV
-    if not os.path.exists(src):
-        print(f"Erreur: le fichier d'entrée n'existe pas: {src}", file=sys.stderr)
+def categorize_column(values, mapper):
+    """mapper(split_tokens(x)) pour chaque cellule, calculé une seule fois par
+    valeur distincte (pd.factorize) puis redistribué sur toutes les lignes."""
+    codes, uniques = pd.factorize(values.fillna("").astype(str))
+    # Temps de normalisation/tokenisation et de matching, séparés, par fonction
+    with spa_metrics.timer("categorize_seconds_total", phase="norm_split", mapper=mapper.__name__):
+        tokens = [split_tokens(u) for u in uniques]
+    with spa_metrics.timer("categorize_seconds_total", phase="match", mapper=mapper.__name__):
+        categories = np.array([mapper(t) for t in tokens], dtype=object)
+    if mapper in FUZZY_CLASSIFIERS:
+        with spa_metrics.timer("categorize_seconds_total", phase="fuzzy", mapper=mapper.__name__):
+            FUZZY_CLASSIFIERS[mapper].refine(tokens, categories)
+    spa_metrics.inc("categorize_cells_total", len(values), mapper=mapper.__name__)
+    spa_metrics.inc("categorize_distinct_cells_total", len(uniques), mapper=mapper.__name__)
+    return pd.Series(categories[codes], index=values.index, dtype=object)
+
+# -------------------------------------------
+# Étape 6 ter. Vérification différentielle des règles compilées
+# -------------------------------------------
+
+
+# Familles vérifiées : (nom, table de règles, matcher compilé)
+RULE_TABLES = [
+    ("behavior", BEHAVIOR_RULES, BEHAVIOR_MATCHER),
+    ("health", HEALTH_RULES, HEALTH_MATCHER),
+    ("adoption", ADOPT_RULES, ADOPT_MATCHER),
+    ("adoption_fallback", ADOPT_FALLBACK_RULES, ADOPT_FALLBACK_MATCHER),
+]
+
+
+def synthetic_tokens(n, seed=0):
+    """Tokens générés à partir des sous-chaînes des règles (entières, tronquées,
+    collées entre elles) et de bruit, pour multiplier les chevauchements."""
+    rng = random.Random(seed)
+    pieces = sorted({sub for _, rules, _ in RULE_TABLES for _, rule in rules for sub in rule["substr"]})
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789_"
+    tokens = []
+    for _ in range(n):
+        parts = []
+        for _ in range(rng.randint(1, 4)):
+            piece = rng.choice(pieces)
+            roll = rng.random()
+            if roll < 0.3:
+                piece = piece[rng.randint(0, len(piece) - 1):]
+            elif roll < 0.5:
+                piece = piece[:rng.randint(1, len(piece))]
+            elif roll < 0.6:
+                piece = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+            parts.append(piece)
+        tokens.append(rng.choice(["", "_", " "]).join(parts))
+    return tokens
+
+
+def self_check(n):
+    """Compare les matchers compilés aux boucles any_substr d'origine."""
+    tokens = synthetic_tokens(n)
+    accented = [t.upper().replace("E", "É").replace("A", "À").replace("_", "-") for t in tokens[:n // 4]]
+    samples = tokens + accented + ["  Très-Câlin “Chat” ", "l’œil", "ß straße", "Ｆｕｌｌ", "\u00a0x\t y"]
+    diffs = [t for t in samples if norm(t) != norm_naive(t)]
+    print(f"{'norm':<18} {len(samples)} textes : différences={len(diffs)}")
+    for t in diffs[:5]:
+        print(f"    {t!r}: {norm_naive(t)!r} != {norm(t)!r}")
+    ok = not diffs
+    for name, rules, matcher in RULE_TABLES:
+        start = time.perf_counter()
+        naive = [first_rule_naive(t, rules) for t in tokens]
+        t_naive = time.perf_counter() - start
+        matcher.memo.clear()
+        start = time.perf_counter()
+        compiled = [matcher.first(t) for t in tokens]
+        t_compiled = time.perf_counter() - start
+
+        diffs = [t for t, a, b in zip(tokens, naive, compiled) if a != b]
+        matched = sum(cat is not None for cat in naive)
+        print(f"{name:<18} {n} tokens ({matched} avec règle) : any_substr {t_naive:6.2f}s, "
+              f"compilé {t_compiled:6.2f}s, différences={len(diffs)}")
+        for t in diffs[:5]:
+            print(f"    {t!r}: {first_rule_naive(t, rules)!r} != {matcher.first(t)!r}")
+        ok = ok and not diffs
+
+    classifier = FuzzyClassifier(BEHAVIOR_RULES, BEHAVIOR_MATCHER)
+    start = time.perf_counter()
+    _, confidence = classifier.score(sorted(set(tokens)))
+    print(f"{'fuzzy':<18} {len(set(tokens))} tokens distincts notés en "
+          f"{time.perf_counter() - start:.2f}s ({(confidence >= FUZZY_THRESHOLD).sum()} au-dessus du seuil)")
+    return ok
+
+# -------------------------------------------
+# Étape 6 quater. Classifieur flou pour les cellules sans règle
+# -------------------------------------------
+
+
+def ngram_hashes(texts, n=FUZZY_NGRAM, dim=FUZZY_DIM):
+    """(ligne, hash) de chaque n-gramme de caractères de chaque texte.
+
+    Les textes sont rangés dans une matrice de points de code (U fixe vu
+    en uint32) : tous les n-grammes sont hachés d'un coup, sans boucle
+    Python par caractère.
+    """
+    texts = [t[:FUZZY_MAX_LEN] for t in texts]
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    width = max(int(lengths.max(initial=0)), n)
+    codes = np.array(texts, dtype=f"<U{width}").view(np.uint32).reshape(len(texts), width)
+    h = np.zeros((len(texts), width - n + 1), dtype=np.uint64)
+    for k in range(n):
+        h = h * np.uint64(1_000_003) + codes[:, k:k + width - n + 1]
+    valid = np.arange(width - n + 1)[None, :] <= (lengths[:, None] - n)
+    rows, _ = np.nonzero(valid)
+    return rows, (h[valid] % np.uint64(dim)).astype(np.int64)
+
+
+class FuzzyClassifier:
+    """Centroides de n-grammes hachés, un par catégorie, construits à partir
+    des sous-chaînes des règles.
+
+    Ne s'applique qu'aux cellules qui tombent aujourd'hui dans la catégorie
+    par défaut (aucune règle ne reconnaît leurs tokens) : tout le vocabulaire
+    de ces cellules est noté en une seule passe, et le premier token dont la
+    similarité atteint `threshold` donne sa catégorie. Sinon, rien ne change.
+    """
+
+    def __init__(self, rules, matcher, threshold=FUZZY_THRESHOLD, joined_matcher=None):
+        self.categories = [cat for cat, _ in rules]
+        self.matcher = matcher
+        self.joined_matcher = joined_matcher
+        self.threshold = threshold
+
+        subs = [sub for _, rule in rules for sub in rule["substr"]]
+        labels = np.repeat(np.arange(len(rules)), [len(rule["substr"]) for _, rule in rules])
+        rows, hashes = ngram_hashes(subs)
+        weights = 1 / np.sqrt(np.maximum(np.bincount(rows, minlength=len(subs)), 1))
+        self.centroids = np.zeros((len(rules), FUZZY_DIM), dtype=np.float32)
+        np.add.at(self.centroids, (labels[rows], hashes), weights[rows])
+        self.centroids /= np.maximum(np.linalg.norm(self.centroids, axis=1, keepdims=True), 1e-9)
+
+    def score(self, tokens):
+        """(indice de catégorie, similarité cosinus) pour chaque token.
+
+        Produit creux (tokens x n-grammes) @ (n-grammes x catégories) : les
+        colonnes de centroïdes des n-grammes présents sont rassemblées puis
+        sommées par token (np.add.reduceat).
+        """
+        rows, hashes = ngram_hashes(tokens)
+        counts = np.bincount(rows, minlength=len(tokens))
+        scores = np.zeros((len(tokens), len(self.categories)), dtype=np.float32)
+        present = counts > 0
+        if present.any():
+            gathered = self.centroids[:, hashes].T
+            starts = (np.cumsum(counts) - counts)[present]
+            scores[present] = np.add.reduceat(gathered, starts, axis=0) / np.sqrt(counts[present])[:, None]
+        return scores.argmax(axis=1), scores.max(axis=1)
+
+    def falls_through(self, toks):
+        if not toks or any(self.matcher.first(t) is not None for t in toks):
+            return False
+        return self.joined_matcher is None or self.joined_matcher.first(" ".join(toks)) is None
+
+    def refine(self, cells, categories):
+        """Remplace en place la catégorie par défaut des cellules sans règle."""
+        todo = [i for i, toks in enumerate(cells) if self.falls_through(toks)]
+        vocab = sorted({t for i in todo for t in cells[i]})
+        if not vocab:
+            return
+        best, confidence = self.score(vocab)
+        predicted = {t: self.categories[b] for t, b, c in zip(vocab, best, confidence)
+                     if c >= self.threshold}
+        for i in todo:
+            for t in cells[i]:
+                if t in predicted:
+                    categories[i] = predicted[t]
+                    break
+
+
+# Rempli par enable_fuzzy() : mapper -> classifieur appliqué après lui
+FUZZY_CLASSIFIERS = {}
+
+
+def enable_fuzzy(threshold=FUZZY_THRESHOLD):
+    FUZZY_CLASSIFIERS.update({
+        map_behavior_category: FuzzyClassifier(BEHAVIOR_RULES, BEHAVIOR_MATCHER, threshold),
+        map_health_category: FuzzyClassifier(HEALTH_RULES, HEALTH_MATCHER, threshold),
+        map_adoption_category: FuzzyClassifier(ADOPT_RULES, ADOPT_MATCHER, threshold,
+                                               joined_matcher=ADOPT_FALLBACK_MATCHER),
+    })
+
+# -------------------------------------------
+# Étape 7. Format long : une catégorie par mot-clé
+# -------------------------------------------
+
+
+# Famille de mots-clés -> (fonction de catégorisation, colonne finale)
+FAMILY_MAPPERS = {
+    "behavior_keywords": (map_behavior_category, "behavior_category"),
+    "health_keywords": (map_health_category, "health_category"),
+    "adoption_keywords": (map_adoption_category, "adoption_category"),
+    "compatibility_keywords": (map_compatibility_norm, "compatibility_tags"),
+}
+
+
+def categorize_long(keywords):
+    """Ajoute une colonne `category` à la table longue de l'étape 3.
+
+    Chaque mot-clé est catégorisé seul, exactement comme la cellule
+    `*_separated` de la ligne élargie correspondante ; reason_abandon
+    n'a pas de catégorie.
+    """
+    with spa_metrics.stage("final") as stage:
+        out = keywords.copy()
+        out["category"] = ""
+        for family, (mapper, _) in FAMILY_MAPPERS.items():
+            mask = out["family"] == family
+            out.loc[mask, "category"] = categorize_column(out.loc[mask, "keyword"], mapper)
+        stage.rows = len(out)
+    return out
+
+
+def join_final(animals, categorized):
+    """Reconstruit à la demande le CSV final historique (une ligne par position)."""
+    stage3 = importlib.import_module("3_csv_mots_clés_séparés")
+    wide = stage3.join_wide(animals, categorized,
+                            {"keyword": "{family}_separated", "category": "{family}_category"})
+    wide = wide.drop(columns="reason_abandon_category").rename(
+        columns={f"{family}_category": col for family, (_, col) in FAMILY_MAPPERS.items()})
+    final_cols = ["behavior_category", "health_category", "adoption_category", "compatibility_tags"]
+    return wide[[c for c in wide.columns if c not in final_cols] + final_cols]
+
+
+def main_long(args):
+    if not os.path.exists(args.keywords):
+        print(f"Erreur: le fichier d'entrée n'existe pas: {args.keywords}", file=sys.stderr)
         sys.exit(1)
 
-    print(f"Lecture: {src}")
-    df = pd.read_csv(src)
+    print(f"Lecture: {args.keywords}")
+    keywords = spa_io.read_table(args.keywords, columns=["animal_id", "family", "position", "keyword"],
+                                 dtype={"keyword": str})
+    categorized = categorize_long(keywords)
+    spa_io.write_table(categorized, args.categories_output)
+    print(f"Écrit: {args.categories_output} ({len(categorized)} mots-clés)")
+
+    # Jointure avec la table animaux seulement si le format élargi est demandé
+    if args.wide_output:
+        animals = spa_io.read_table(args.animals)
+        spa_io.write_table(join_final(animals, categorized), args.wide_output)
+        print(f"Écrit: {args.wide_output}")
 
+# -------------------------------------------
+# Étape 7 bis. Cache persistant token -> catégorie
+# -------------------------------------------
+
+
+def rule_ranks(rules):
+    """Sous-chaîne -> (priorité, catégorie) de la première règle qui la contient."""
+    ranks = {}
+    for i, (cat, rule) in enumerate(rules):
+        for sub in rule["substr"]:
+            ranks.setdefault(sub, (i, cat))
+    return ranks
+
+
+def rules_hash(rules):
+    return hashlib.sha256(json.dumps(rules, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+class CategoryCache:
+    """Cache SQLite des résultats de RuleMatcher.first, par famille de règles.
+
+    Chaque famille garde le hash et le contenu de la table de règles avec
+    laquelle ses tokens ont été classés. Si la table change, seuls les
+    tokens contenant une sous-chaîne ajoutée, retirée ou dont la règle
+    (priorité ou catégorie) a changé sont supprimés : pour tous les autres,
+    l'ensemble des règles qui les touchent est identique, donc leur
+    catégorie aussi.
+    """
+
+    def __init__(self, path=CACHE_FILE):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS rules (
+            family TEXT PRIMARY KEY, hash TEXT, rules TEXT)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tokens (
+            family TEXT, token TEXT, category TEXT, PRIMARY KEY (family, token))""")
+
+    def sync(self, family, rules):
+        """Aligne le cache sur `rules` et renvoie (tokens repris, tokens invalidés)."""
+        digest = rules_hash(rules)
+        row = self.db.execute("SELECT hash, rules FROM rules WHERE family = ?", (family,)).fetchone()
+        invalidated = 0
+        if row is not None and row[0] != digest:
+            old, new = rule_ranks(json.loads(row[1])), rule_ranks(rules)
+            changed = sorted({sub for sub in old.keys() | new.keys() if old.get(sub) != new.get(sub)})
+            affected = re.compile("|".join(map(re.escape, changed))) if changed else None
+            stale = [(family, token) for (token,) in self.db.execute(
+                "SELECT token FROM tokens WHERE family = ?", (family,))
+                if affected is not None and affected.search(token)]
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM tokens WHERE family = ? AND token = ?", stale)
+            self.db.execute("COMMIT")
+            invalidated = len(stale)
+        if row is None or row[0] != digest:
+            self.db.execute("INSERT OR REPLACE INTO rules VALUES (?, ?, ?)",
+                            (family, digest, json.dumps(rules, ensure_ascii=False)))
+        kept = self.db.execute("SELECT COUNT(*) FROM tokens WHERE family = ?", (family,)).fetchone()[0]
+        return kept, invalidated
+
+    def load(self, family, matcher):
+        for token, category in self.db.execute(
+                "SELECT token, category FROM tokens WHERE family = ?", (family,)):
+            matcher.memo[token] = category
+
+    def save(self, family, matcher):
+        rows = [(family, token, matcher.memo[token]) for token in matcher.fresh]
+        self.db.execute("BEGIN")
+        self.db.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", rows)
+        self.db.execute("COMMIT")
+        matcher.fresh.clear()
+        return len(rows)
+
+    def close(self):
+        self.db.close()
+
+
+def open_cache(path):
+    """Synchronise toutes les familles et précharge leurs matchers."""
+    cache = CategoryCache(path)
+    for name, rules, matcher in RULE_TABLES:
+        kept, invalidated = cache.sync(name, rules)
+        cache.load(name, matcher)
+        if invalidated:
+            print(f"Cache {name}: règles modifiées, {invalidated} tokens à reclasser, {kept} repris")
+    return cache
+
+
+def close_cache(cache):
+    added = sum(cache.save(name, matcher) for name, _, matcher in RULE_TABLES)
+    print(f"Cache: {added} nouveaux tokens enregistrés")
+    cache.close()
+
+# -------------------------------------------
+# Étape 8. Exécution globale
+# -------------------------------------------
+
+
+# Colonne finale -> familles de règles dont elle dépend
+COLUMN_RULES = {
+    "behavior_category": ["behavior"],
+    "health_category": ["health"],
+    "adoption_category": ["adoption", "adoption_fallback"],
+    "compatibility_tags": [],
+}
+
+
+def categorize_frame(df, columns=None):
+    """Ajoute les 4 colonnes finales (ou seulement `columns`) à df."""
+    with spa_metrics.stage("final") as stage:
+        stage.rows = len(df)
+        return _categorize_frame(df, columns)
+
+
+def _categorize_frame(df, columns):
     # 8.2 Colonnes d'entrée attendues
     behavior_col = "behavior_keywords_separated"
     compat_col = "compatibility_keywords_separated"
@@ -375,22 +845,187 @@ def main():
             df[col] = ""
         df[col] = df[col].fillna("")
 
-    # 8.4 Application: cellule -> tokens -> catégorie/tags
-    df["behavior_category"] = df[behavior_col].apply(
-        lambda x: map_behavior_category(split_tokens(x)))
+    # 8.4 Application: cellule -> tokens -> catégorie/tags (une fois par valeur distincte)
+    for family, (mapper, col) in FAMILY_MAPPERS.items():
+        if columns is None or col in columns:
+            df[col] = categorize_column(df[f"{family}_separated"], mapper)
+    return df
+
+
+def run_stamp(src, fuzzy=None):
+    """Ce dont dépend la sortie : fichier d'entrée, version de chaque table de
+    règles et seuil du classifieur flou."""
+    st = os.stat(src)
+    return {"input": [os.path.abspath(src), st.st_size, st.st_mtime_ns],
+            "rules": {name: rules_hash(rules) for name, rules, _ in RULE_TABLES},
+            "fuzzy": fuzzy}
+
+
+def stale_columns(dst, stamp):
+    """Colonnes de dst à recalculer, ou None si dst ne vient pas de la même entrée."""
+    try:
+        with open(dst + ".rules.json", encoding="utf-8") as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if previous.get("input") != stamp["input"] or not os.path.exists(dst):
+        return None
+    fuzzy_changed = previous.get("fuzzy") != stamp["fuzzy"]
+    return [col for col, families in COLUMN_RULES.items()
+            if any(previous["rules"].get(f) != stamp["rules"][f] for f in families)
+            or (fuzzy_changed and families)]
+
+# -------------------------------------------
+# Étape 9. Mode par blocs : lecture en streaming + pool de processus
+# -------------------------------------------
 
-    df["health_category"] = df[health_col].apply(
-        lambda x: map_health_category(split_tokens(x)))
 
-    df["adoption_category"] = df[adopt_col].apply(
-        lambda x: map_adoption_category(split_tokens(x)))
+def init_worker(cache_path, fuzzy=None):
+    """Précharge dans chaque worker les tokens déjà en cache (et le classifieur flou)."""
+    if fuzzy is not None:
+        enable_fuzzy(fuzzy)
+    if cache_path:
+        cache = CategoryCache(cache_path)
+        for name, _, matcher in RULE_TABLES:
+            cache.load(name, matcher)
+        cache.close()
+
+
+def categorize_chunk(chunk, header, columns=None):
+    """Exécuté dans un worker : renvoie le texte CSV du bloc, les tokens
+    nouvellement classés, que le processus principal enregistre en cache,
+    et les métriques du bloc, qu'il additionne aux siennes."""
+    text = categorize_frame(chunk, columns).to_csv(index=False, header=header)
+    fresh = {}
+    for name, _, matcher in RULE_TABLES:
+        fresh[name] = [(token, matcher.memo[token]) for token in matcher.fresh]
+        matcher.fresh.clear()
+    return text, fresh, spa_metrics.take()
+
+
+def main_chunked(src, dst, chunksize, workers=None, columns=None, cache_path=None, fuzzy=None):
+    """Catégorise `src` par blocs de `chunksize` lignes répartis sur `workers`
+    processus ; les blocs sont écrits dans l'ordre de lecture.
+
+    Au plus 2 blocs par worker sont en vol (lus, en calcul ou en attente
+    d'écriture) : la mémoire reste bornée quelle que soit la taille du
+    fichier. Les colonnes sont lues en texte (dtype=str) pour que chaque
+    bloc soit recopié à l'identique, sans inférence de types bloc par bloc.
+    """
+    workers = workers or os.cpu_count() or 1
+    matchers = {name: matcher for name, _, matcher in RULE_TABLES}
+    part = dst + ".part"
+    print(f"Lecture par blocs de {chunksize} lignes: {src} ({workers} processus)")
+
+    def write(future):
+        text, fresh, metrics = future.result()
+        spa_metrics.merge(metrics)
+        f.write(text)
+        for name, items in fresh.items():
+            for token, category in items:
+                matchers[name].memo[token] = category
+                matchers[name].fresh.append(token)
+
+    rows = 0
+    with open(part, "w", encoding="utf-8", newline="") as f, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(cache_path, fuzzy)) as pool:
+        pending = deque()
+        for k, chunk in enumerate(pd.read_csv(src, chunksize=chunksize, dtype=str)):
+            pending.append(pool.submit(categorize_chunk, chunk, k == 0, columns))
+            rows += len(chunk)
+            while len(pending) >= 2 * workers:
+                write(pending.popleft())
+        while pending:
+            write(pending.popleft())
+    os.replace(part, dst)
+    print(f"Écrit: {dst} ({rows} lignes)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catégorisation finale des mots-clés")
+    parser.add_argument("--input", default=INPUT_CSV)
+    parser.add_argument("--output", default=OUTPUT_CSV)
+    parser.add_argument("--chunksize", type=int, metavar="N",
+                        help="lit l'entrée par blocs de N lignes, catégorisés en parallèle")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processus pour --chunksize (par défaut : nombre de cœurs)")
+    parser.add_argument("--cache", default=CACHE_FILE,
+                        help="cache SQLite token -> catégorie, versionné par table de règles")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--incremental", action="store_true",
+                        help="ne recalcule que les colonnes dont les règles ont changé depuis "
+                             "la sortie précédente (même fichier d'entrée)")
+    parser.add_argument("--fuzzy", nargs="?", type=float, const=FUZZY_THRESHOLD, metavar="SEUIL",
+                        help="classe par similarité de n-grammes les cellules qu'aucune règle "
+                             f"ne reconnaît (seuil par défaut {FUZZY_THRESHOLD})")
+    parser.add_argument("--format", choices=["wide", "long"], default="wide",
+                        help="long : lit la table de mots-clés de l'étape 3 (--format long)")
+    parser.add_argument("--animals", default=ANIMALS_CSV)
+    parser.add_argument("--keywords", default=KEYWORDS_LONG_CSV)
+    parser.add_argument("--categories-output", default=CATEGORIES_LONG_CSV)
+    parser.add_argument("--wide-output", metavar="CSV",
+                        help="en format long, écrit aussi le CSV final élargi (jointure)")
+    parser.add_argument("--self-check", nargs="?", type=int, const=200_000, metavar="N",
+                        help="vérifie les règles compilées contre any_substr sur N tokens générés")
+    spa_metrics.add_arguments(parser, "4_final")
+    args = parser.parse_args(argv)
+
+    if args.self_check:
+        sys.exit(0 if self_check(args.self_check) else 1)
+
+    if args.fuzzy is not None:
+        enable_fuzzy(args.fuzzy)
+    cache_path = None if args.no_cache else args.cache
+    cache = open_cache(cache_path) if cache_path else None
+    try:
+        with spa_metrics.session(args):
+            if args.format == "long":
+                main_long(args)
+            else:
+                main_wide(args, cache_path)
+    finally:
+        if cache is not None:
+            close_cache(cache)
+
+
+def main_wide(args, cache_path=None):
+    # 8.1 Lecture du CSV source
+    src = args.input
+    dst = args.output
+    if not os.path.exists(src):
+        print(f"Erreur: le fichier d'entrée n'existe pas: {src}", file=sys.stderr)
+        sys.exit(1)
+
+    stamp = run_stamp(src, args.fuzzy)
+    columns = stale_columns(dst, stamp) if args.incremental else None
+    if columns == []:
+        print(f"À jour: {dst} (ni l'entrée ni les règles n'ont changé)")
+        return
+    if columns is not None:
+        # La sortie précédente contient déjà tout le reste : on la relit à la place de l'entrée
+        print(f"Incrémental: seules les colonnes {', '.join(columns)} sont recalculées")
+        src = dst
+
+    if args.chunksize and (spa_io.is_parquet(src) or spa_io.is_parquet(dst)):
+        print("Erreur: --chunksize ne traite que des CSV", file=sys.stderr)
+        sys.exit(1)
+    if args.chunksize:
+        main_chunked(src, dst, args.chunksize, args.workers, columns, cache_path, args.fuzzy)
+    else:
+        print(f"Lecture: {src}")
+        if columns is None or spa_io.is_parquet(src):
+            df = spa_io.read_table(src)
+        else:
+            df = pd.read_csv(src, dtype=str, keep_default_na=False)
+        df = categorize_frame(df, columns)
 
-    df["compatibility_tags"] = df[compat_col].apply(
-        lambda x: map_compatibility_norm(split_tokens(x)))
+        # 8.5 Écriture du résultat (CSV, ou Parquet selon l'extension)
+        spa_io.write_table(df, dst)
+        print(f"Écrit: {dst}")
 
-    # 8.5 Écriture du CSV résultat
-    df.to_csv(dst, index=False)
-    print(f"Écrit: {dst}")
+    with open(dst + ".rules.json", "w", encoding="utf-8") as f:
+        json.dump(stamp, f, ensure_ascii=False, indent=2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,431 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+
+# Les étapes, importées comme modules (leurs noms commencent par un chiffre)
+scrap = importlib.import_module("1_scrap_site_spa")
+api = importlib.import_module("2_api_csv")
+separation = importlib.import_module("3_csv_mots_clés_séparés")
+final = importlib.import_module("4_csv_final")
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+
+OUTPUT_FILE = "animaux_spa_benchmark.json"
+BASE_ANIMALS = 1_000      # Taille du catalogue synthétique à l'échelle 1x
+SCALES = [1, 10, 100]     # 1000 possible (--scales 1 10 100 1000), compter plusieurs Go de RAM
+PAGE_SIZE = 24            # Animaux par page du faux moteur de recherche
+SEARCH_LATENCY = 0.01     # Latence (s) de chaque page du faux moteur de recherche
+LLM_LATENCY = 0.02        # Latence (s) de chaque appel à la fausse API Responses
+ANALYZE_SAMPLE = 500      # Descriptions analysées au plus par échelle (appels un par un)
+SEED = 0
+
+STAGES = ["scrape", "analyze_description", "expand_lists",
+          "map_behavior_category", "map_health_category",
+          "map_adoption_category", "map_compatibility_norm"]
+
+# ============================================================
+# DONNÉES SYNTHÉTIQUES
+# ============================================================
+# Mots-clés tirés des sous-chaînes des tables de règles de l'étape 4 (et
+# des lexiques du backend local), descriptions composées à partir d'eux :
+# la distribution ressemble au catalogue sans dépendre du vrai site.
+
+
+def vocabularies():
+    """Famille de mots-clés -> vocabulaire tiré des règles."""
+    def substrings(*tables):
+        return sorted({sub for rules in tables for _, rule in rules for sub in rule["substr"]})
+    compat = [f"{subject}_{answer}" for subject, _ in api.COMPAT_SUBJECTS for answer in ("ok", "non")]
+    return {
+        "reason_abandon": sorted({keyword for _, keyword in api.REASON_LEXICON}),
+        "behavior_keywords": substrings(final.BEHAVIOR_RULES),
+        "compatibility_keywords": compat,
+        "health_keywords": substrings(final.HEALTH_RULES),
+        "adoption_keywords": substrings(final.ADOPT_RULES, final.ADOPT_FALLBACK_RULES),
+    }
+
+
+def synthetic_animals(n, seed=SEED):
+    """n enregistrements au format de l'API de recherche, listes de mots-clés comprises."""
+    rng = random.Random(seed)
+    vocab = vocabularies()
+    animals = []
+    for i in range(n):
+        keywords = {family: rng.sample(words, rng.randint(0, min(4, len(words))))
+                    for family, words in vocab.items()}
+        words = [w.replace("_", " ") for family in keywords.values() for w in family]
+        rng.shuffle(words)
+        name = f"animal_{i}"
+        description = f"{name.capitalize()} est à l'adoption. " + ", ".join(words) + "."
+        animals.append({"id": i, "name": name, "description": description,
+                        "experienced_owner": rng.random() < 0.2, **keywords})
+    return animals
+
+
+def keyword_frame(animals):
+    """Sortie de l'étape 2 : description + les 5 colonnes de listes."""
+    return pd.DataFrame(animals).drop(columns="experienced_owner")
+
+
+def search_records(animals):
+    """Ce que renvoie le site : sans les mots-clés, qui sont calculés par l'étape 2."""
+    return [{k: v for k, v in animal.items() if k not in api.KEYWORD_COLUMNS} for animal in animals]
+
+# ============================================================
+# FAUX SERVICES HTTP (hors-ligne)
+# ============================================================
+
+
+class FakeServer:
+    """Serveur HTTP local dans un thread ; `url` est fixé au démarrage."""
+
+    path = "/"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # Requêtes simultanées au plus fort (tests de concurrence)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # En-têtes et corps partent en deux écritures : sans NODELAY,
+                # l'ACK retardé ajoute ~40 ms à chaque réponse keep-alive
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._reply(server.handle("GET", self.path, None))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._reply(server.handle("POST", self.path, json.loads(body or b"{}")))
+
+            def _reply(self, result):
+                # handle() renvoie le corps JSON, ou (code HTTP, corps, en-têtes)
+                status, payload, headers = result if isinstance(result, tuple) else (200, result, {})
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.delay(self.path))
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}{self.path}"
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+    def delay(self, path):
+        return self.latency
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class FakeSearchServer(FakeServer):
+    """Moteur de recherche du site : `paged=N` renvoie la N-ième page, puis des pages vides.
+
+    `latencies` fixe la latence de certaines pages ; `failures` donne, par
+    page, les réponses en erreur (code, en-têtes) servies avant la bonne.
+    """
+
+    def __init__(self, animals, page_size=PAGE_SIZE, latency=SEARCH_LATENCY,
+                 latencies=None, failures=None):
+        super().__init__(latency)
+        self.animals = animals
+        self.page_size = page_size
+        self.latencies = latencies or {}
+        self.failures = {page: list(errors) for page, errors in (failures or {}).items()}
+        self.hits = {}  # page -> [instant de chaque requête]
+
+    @staticmethod
+    def page_of(path):
+        return int(parse_qs(urlparse(path).query)["paged"][0])
+
+    def delay(self, path):
+        return self.latencies.get(self.page_of(path), self.latency)
+
+    def handle(self, method, path, body):
+        page = self.page_of(path)
+        with self._lock:
+            self.hits.setdefault(page, []).append(time.monotonic())
+            errors = self.failures.get(page)
+            if errors:
+                status, headers = errors.pop(0)
+                return status, {}, headers
+        start = (page - 1) * self.page_size
+        return {"results": self.animals[start:start + self.page_size]}
+
+
+class FakeResponsesServer(FakeServer):
+    """API Responses : réponse valide (schéma des 5 listes) après `latency` secondes.
+
+    Une fraction des appels peut échouer : `rate_limit_rate` de 429 (avec
+    Retry-After), `error_rate` de 500 et `invalid_rate` de réponses qui ne
+    sont pas du JSON (pour le prompt de réparation).
+    """
+
+    path = "/v1"
+
+    def __init__(self, latency=LLM_LATENCY, rate_limit_rate=0.0, error_rate=0.0,
+                 invalid_rate=0.0, retry_after=0.05):
+        super().__init__(latency)
+        self.vocab = vocabularies()
+        self.rng = random.Random(SEED)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.retry_after = retry_after
+        self.status_counts = {}
+
+    def handle(self, method, path, body):
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return self._error(429, "rate_limit_exceeded", {"Retry-After": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return self._error(500, "server_error")
+        self.status_counts[200] = self.status_counts.get(200, 0) + 1
+        prompt = body.get("input", "")
+        batch = re.search(r"Descriptions \(JSON\) :\s*(\[.*?\])\n", prompt, re.DOTALL) \
+            if isinstance(prompt, str) else None
+        if batch:
+            # Prompt groupé : un objet par id, dans un tableau JSON
+            text = json.dumps([dict(self._keywords(), id=row["id"]) for row in json.loads(batch.group(1))],
+                              ensure_ascii=False)
+        else:
+            text = json.dumps(self._keywords(), ensure_ascii=False)
+        if roll < self.rate_limit_rate + self.error_rate + self.invalid_rate:
+            text = "Voici les mots-clés demandés."
+        input_tokens = len(prompt if isinstance(prompt, str) else json.dumps(prompt)) // 4
+        return {
+            "id": f"resp_{self.requests}", "object": "response", "created_at": 0,
+            "model": body.get("model"), "status": "completed",
+            "output": [{"type": "message", "id": "msg", "role": "assistant", "status": "completed",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(text) // 4,
+                      "total_tokens": input_tokens + len(text) // 4,
+                      "input_tokens_details": {"cached_tokens": 0},
+                      "output_tokens_details": {"reasoning_tokens": 0}},
+            "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+        }
+
+    def _keywords(self):
+        return {family: self.rng.sample(words, min(2, len(words))) for family, words in self.vocab.items()}
+
+    def _error(self, status, code, headers=None):
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return status, {"error": {"message": code, "type": code, "code": code}}, headers or {}
+
+# ============================================================
+# MESURE D'UNE ÉTAPE (processus neuf à chaque fois)
+# ============================================================
+# Chaque mesure tourne dans un processus lancé pour elle seule : les
+# caches en mémoire (memo des matchers, client HTTP...) repartent de zéro
+# et le pic de mémoire ne mélange pas les étapes. Sous Linux, le pic est
+# remis à zéro après la génération des données (/proc/self/clear_refs).
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return None
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass  # Hors Linux : le pic inclut la génération des données
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def prepare_stage(stage, n, options):
+    """Données d'entrée de l'étape et fonction mesurée (renvoie le nombre de lignes traitées)."""
+    animals = synthetic_animals(n)
+
+    if stage == "scrape":
+        def run():
+            with FakeSearchServer(search_records(animals), options["page_size"],
+                                  options["search_latency"]) as server, \
+                    contextlib.redirect_stdout(io.StringIO()):  # "Page N récupérée..."
+                return len(scrap.crawl(options["concurrency"], base_url=server.url))
+        return n, run
+
+    if stage == "analyze_description":
+        texts = [animal["description"] for animal in animals[:options["analyze_sample"]]]
+
+        def run():
+            with FakeResponsesServer(options["llm_latency"]) as server:
+                api.BACKEND, api.BASE_URL, api._cache = options["api_backend"], server.url, None
+                for text in texts:
+                    api.analyze_description(text)
+            return len(texts)
+        return len(texts), run
+
+    keywords = keyword_frame(animals)
+    if stage == "expand_lists":
+        return n, lambda: len(separation.expand_lists(keywords))
+
+    expanded = separation.expand_lists(keywords)
+    del animals, keywords
+    for family, (mapper, _) in final.FAMILY_MAPPERS.items():
+        if mapper.__name__ == stage:
+            values = expanded[f"{family}_separated"].fillna("")
+            return len(values), lambda: len(final.categorize_column(values, mapper))
+    raise ValueError(f"Étape inconnue : {stage}")
+
+
+def measure(stage, scale, options):
+    n = BASE_ANIMALS * scale
+    rows, run = prepare_stage(stage, n, options)
+    rss_before = current_rss_mb()
+    reset_peak_rss()
+    start = time.perf_counter()
+    done = run()
+    seconds = time.perf_counter() - start
+    return {
+        "stage": stage, "scale": scale, "animals": n, "rows": done,
+        "seconds": round(seconds, 4),
+        "rows_per_s": round(done / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_before_mb": round(rss_before, 1) if rss_before is not None else None,
+        "sampled": rows < n if stage == "analyze_description" else False,
+    }
+
+
+def measure_in_subprocess(stage, scale, options):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(measure, stage, scale, options).result()
+
+# ============================================================
+# RÉSULTATS ET COMPARAISON
+# ============================================================
+
+
+def run_metadata(options):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit or None,
+            "python": platform.python_version(), "machine": platform.platform(),
+            "cpus": os.cpu_count(), "base_animals": BASE_ANIMALS, "options": options}
+
+
+def compare(results, previous_path):
+    """Affiche le rapport de temps avec un run précédent (>1 = plus lent qu'avant)."""
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {(r["stage"], r["scale"]): r for r in json.load(f)["results"]}
+    print(f"\nComparaison avec {previous_path} :")
+    for r in results:
+        old = previous.get((r["stage"], r["scale"]))
+        if old is None or not old["rows_per_s"] or not r["rows_per_s"]:
+            continue
+        ratio = old["rows_per_s"] / r["rows_per_s"]
+        flag = "  <-- régression" if ratio > 1.2 else ""
+        print(f"{r['stage']:<24} x{r['scale']:<5} temps x{ratio:.2f}, "
+              f"mémoire {old['peak_rss_mb']:.0f} -> {r['peak_rss_mb']:.0f} Mo{flag}")
+
+# ============================================================
+# EXÉCUTION
+# ============================================================
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark des étapes sur un catalogue synthétique (faux site, fausse API)")
+    parser.add_argument("--scales", nargs="+", type=int, default=SCALES,
+                        help=f"multiples de {BASE_ANIMALS} animaux")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--compare", metavar="JSON", help="résultats d'un run précédent")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--search-latency", type=float, default=SEARCH_LATENCY)
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY)
+    parser.add_argument("--analyze-sample", type=int, default=ANALYZE_SAMPLE,
+                        help="descriptions envoyées à analyze_description par échelle")
+    parser.add_argument("--api-backend", choices=sorted(api.BACKENDS), default="openai",
+                        help="backend de analyze_description (openai = fausse API locale)")
+    parser.add_argument("--concurrency", type=int, default=scrap.CONCURRENCY,
+                        help="pages téléchargées en parallèle par le scraper")
+    args = parser.parse_args(argv)
+
+    options = {"page_size": args.page_size, "search_latency": args.search_latency,
+               "llm_latency": args.llm_latency, "analyze_sample": args.analyze_sample,
+               "api_backend": args.api_backend, "concurrency": args.concurrency}
+    results = []
+    for scale in args.scales:
+        for stage in args.stages:
+            r = measure_in_subprocess(stage, scale, options)
+            results.append(r)
+            note = " (échantillon)" if r["sampled"] else ""
+            print(f"{stage:<24} x{scale:<5} {r['rows']:>9} lignes{note} : {r['seconds']:8.2f}s, "
+                  f"{r['rows_per_s']:>11,.0f} lignes/s, pic {r['peak_rss_mb']:7.0f} Mo")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"meta": run_metadata(options), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"Résultats : {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
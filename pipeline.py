@@ -0,0 +1,310 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import importlib
+import os
+import queue
+import shlex
+import threading
+import time
+import pandas as pd
+import spa_io
+import spa_metrics
+
+# Les 4 étapes, importées comme modules (leurs noms commencent par un chiffre)
+scrap = importlib.import_module("1_scrap_site_spa")
+api = importlib.import_module("2_api_csv")
+separation = importlib.import_module("3_csv_mots_clés_séparés")
+final = importlib.import_module("4_csv_final")
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+
+CACHE_DIR = "animaux_spa_pipeline_cache"  # Résultat de chaque étape, par hash d'entrée
+OUTPUT_FILE = final.OUTPUT_CSV
+STREAM_QUEUE_SIZE = 4    # Pages en attente entre deux étapes : au-delà, l'étape amont attend
+STREAM_CHUNK_SIZE = 100  # Lignes par morceau quand le streaming part d'un CSV (--input)
+
+# ============================================================
+# HASH DES ENTRÉES ET DU CODE
+# ============================================================
+
+
+def frame_hash(df):
+    """Empreinte du contenu d'un DataFrame (colonnes et valeurs, listes comprises)."""
+    h = hashlib.sha256("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def code_hash(*modules):
+    """Version du code d'une étape : hash des fichiers sources dont elle dépend."""
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class StageCache:
+    """Cache "à la make" : une étape dont l'entrée, le code et les options
+    n'ont pas changé n'est pas relancée, son résultat est relu sur disque.
+
+    Une seule version est gardée par étape (la précédente est supprimée,
+    ainsi que les fichiers de travail de l'étape une fois celle-ci terminée).
+    Un résultat que `complete(résultat)` juge incomplet n'est pas mis en
+    cache et les fichiers de travail sont gardés : la prochaine exécution
+    relance l'étape, qui reprend là où elle en était.
+    """
+
+    def __init__(self, directory=CACHE_DIR, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+
+    def run(self, name, df, code, options, func, complete=None):
+        h = hashlib.sha256("\x1f".join([name, frame_hash(df), code, options]).encode("utf-8"))
+        key = h.hexdigest()[:16]
+        path = os.path.join(self.directory, f"{name}-{key}.pkl")
+        if self.enabled and os.path.exists(path):
+            print(f"⏭️  {name} : entrée et code inchangés, résultat repris ({path})")
+            return pd.read_pickle(path)
+
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.perf_counter()
+        result = func(key)
+        print(f"✅ {name} : {len(result)} lignes en {time.perf_counter() - start:.1f}s")
+        if complete is not None and not complete(result):
+            print(f"⚠️  {name} : résultat incomplet, pas mis en cache (relancer pour reprendre)")
+            return result
+        # Anciennes versions et fichiers de travail (journal) de l'étape
+        for old in glob.glob(os.path.join(glob.escape(self.directory), f"{name}-*")):
+            os.remove(old)
+        result.to_pickle(path)
+        return result
+
+# ============================================================
+# ÉTAPES
+# ============================================================
+
+
+def run_scrape(options):
+    args = scrap.parse_args(shlex.split(options))
+    return pd.DataFrame(scrap.crawl_records(args))
+
+
+def run_api(df, options, journal):
+    # Journal propre à cette entrée : reprise possible, jamais de résultats d'une autre entrée.
+    # Un journal déjà là vient d'un run incomplet : ses lignes en échec sont relancées.
+    argv = shlex.split(options) + ["--journal", journal]
+    if os.path.exists(journal) and "--retry-failed" not in argv:
+        argv.append("--retry-failed")
+    args = api.parse_args(argv)
+    api.configure(args)
+    try:
+        result = api.process_frame(df, args)
+    finally:
+        api.close_cache()
+    if result is None:
+        raise SystemExit("--write-batch-job n'a pas de sens dans le pipeline")
+    return result
+
+
+def run_separation(df):
+    # Les listes arrivent déjà en listes Python : pas d'aller-retour par le repr
+    return separation.expand_lists(df)
+
+
+def run_final(df):
+    return final.categorize_frame(df.copy())
+
+# ============================================================
+# MODE STREAMING
+# ============================================================
+# Crawl -> extraction -> séparation -> catégories, page par page : chaque
+# étape tourne dans son thread et passe ses pages à la suivante par une
+# file bornée. Quand l'extraction sature, la file se remplit et le crawler
+# attend (iter_pages ne lance de nouvelles requêtes que s'il est consommé) :
+# la mémoire reste constante et les premières lignes sortent tout de suite.
+
+_DONE = object()
+
+
+def _stage_thread(func, out_q):
+    """Exécute func(put) dans un thread ; la fin ou l'erreur est transmise dans out_q."""
+    def run():
+        try:
+            func(out_q.put)
+            out_q.put(_DONE)
+        except BaseException as exc:
+            out_q.put(exc)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _drain(in_q):
+    while True:
+        item = in_q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def run_stream(args):
+    if spa_io.is_parquet(args.output):
+        raise SystemExit("Le mode --stream écrit un CSV (ajout ligne à ligne)")
+    scrape_args = scrap.parse_args(shlex.split(args.scrape_args))
+    # Journal propre à ce run (sortie + options) : une relance après un crash reprend
+    # là où elle s'était arrêtée, sans jamais relire le journal global de 2_api_csv.py
+    key = hashlib.sha256("\x1f".join([os.path.abspath(args.output), args.input or "",
+                                        args.scrape_args, args.api_args]).encode("utf-8"))
+    journal_path = os.path.join(args.cache_dir, f"stream-{key.hexdigest()[:16]}.journal.jsonl")
+    os.makedirs(args.cache_dir, exist_ok=True)
+    api_args = api.parse_args(shlex.split(args.api_args) + ["--journal", journal_path])
+    pages_q = queue.Queue(args.queue_size)
+    keywords_q = queue.Queue(args.queue_size)
+
+    def crawl(put):
+        if args.input:
+            if spa_io.is_parquet(args.input):
+                df = api.load_input(args.input)
+                chunks = (df.iloc[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(df), STREAM_CHUNK_SIZE))
+            else:
+                chunks = pd.read_csv(args.input, chunksize=STREAM_CHUNK_SIZE)
+            for chunk in chunks:
+                put(chunk)
+            return
+        offset = 0
+        failed = []
+        with contextlib.ExitStack() as stack:
+            pages = scrap.open_pages(scrape_args, stack, failed)
+            while True:
+                # Seul le temps de production de la page compte (pas l'attente sur la file)
+                with spa_metrics.stage("scrape") as stage:
+                    _, animals = next(pages, (None, None))
+                    stage.rows = len(animals or [])
+                if animals is None:
+                    if failed:
+                        raise scrap.CrawlIncomplete(failed)
+                    return
+                page = pd.DataFrame(animals)
+                page.index += offset  # index global : clé de journal si les ids manquent
+                offset += len(page)
+                put(page)
+
+    def extract(put):
+        # Le cache SQLite de l'étape 2 doit être ouvert dans le thread qui s'en sert
+        api.PROGRESS = False
+        api.configure(api_args)
+        journal = api.Journal(api_args.journal)
+        # Un seul client / seau à jetons pour tout le run : les limites et le
+        # ralentissement après un 429 ne repartent pas de zéro à chaque page
+        session = api.AsyncSession(api_args.concurrency, api_args.rpm, api_args.tpm) \
+            if api_args.use_async else None
+        try:
+            for page in _drain(pages_q):
+                keywords = api.process_frame(page, api_args, journal=journal, session=session)
+                journal.release(api.row_keys(page))  # Mémoire bornée à la page en cours
+                put(keywords)
+        finally:
+            if session is not None:
+                session.close()
+            journal.close()
+            api.close_cache()
+
+    _stage_thread(crawl, pages_q)
+    _stage_thread(extract, keywords_q)
+
+    start = time.perf_counter()
+    rows = 0
+    # Chaque page terminée est ajoutée directement à la sortie (en-tête de la
+    # première page) : le fichier se remplit pendant le crawl.
+    with scrap.StreamingCsvWriter(args.output, base_keys=(), live=True) as writer:
+        for keywords in _drain(keywords_q):
+            result = final.categorize_frame(separation.expand_lists(keywords))
+            writer.write_rows(result.astype(object).where(result.notna(), None).to_dict("records"))
+            if not rows:
+                print(f"Premières lignes écrites après {time.perf_counter() - start:.1f}s")
+            rows += len(result)
+    os.remove(journal_path)  # Sortie complète : plus rien à reprendre
+    print(f"✅ Streaming : {rows} lignes en {time.perf_counter() - start:.1f}s -> {args.output}")
+
+# ============================================================
+# EXÉCUTION
+# ============================================================
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pipeline complet en mémoire : scraping -> API -> séparation -> catégories")
+    parser.add_argument("--input", metavar="CSV",
+                        help="part d'un CSV déjà scrapé au lieu de crawler le site")
+    parser.add_argument("--scrape-args", default="",
+                        help="options passées à 1_scrap_site_spa.py (ex. \"--concurrency 16\")")
+    parser.add_argument("--api-args", default="",
+                        help="options passées à 2_api_csv.py (ex. \"--backend local\")")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--force", action="store_true",
+                        help="relance toutes les étapes, même inchangées")
+    parser.add_argument("--keep-intermediates", action="store_true",
+                        help="écrit aussi les fichiers intermédiaires habituels (débogage)")
+    parser.add_argument("--intermediate-format", choices=["csv", "parquet"], default="csv",
+                        help="format des fichiers intermédiaires (--keep-intermediates)")
+    parser.add_argument("--stream", action="store_true",
+                        help="traite le catalogue page par page, de bout en bout, sans étape bloquante")
+    parser.add_argument("--queue-size", type=int, default=STREAM_QUEUE_SIZE,
+                        help="pages en attente entre deux étapes en mode --stream")
+    spa_metrics.add_arguments(parser, "pipeline")
+    args = parser.parse_args(argv)
+
+    with spa_metrics.session(args):
+        if args.stream:
+            run_stream(args)
+        else:
+            run_cached(args)
+
+
+def run_cached(args):
+    cache = StageCache(args.cache_dir, enabled=not args.force)
+
+    def intermediate(df, path):
+        if args.keep_intermediates:
+            if args.intermediate_format == "parquet":
+                path = os.path.splitext(path)[0] + ".parquet"
+            spa_io.write_table(df, path)
+            print(f"Intermédiaire : {path}")
+
+    # Étape 1 : le site est l'entrée, elle est donc toujours exécutée ;
+    # les étapes suivantes ne repartent que si son contenu a changé.
+    if args.input:
+        scraped = api.load_input(args.input)  # CSV ou Parquet
+    else:
+        scraped = run_scrape(args.scrape_args)
+        print(f"✅ 1_scrap : {len(scraped)} animaux")
+        intermediate(scraped, scrap.OUTPUT_FILE)
+
+    keywords = cache.run(
+        "2_api", scraped, code_hash(api, final), args.api_args,
+        lambda key: run_api(scraped, args.api_args,
+                            os.path.join(args.cache_dir, f"2_api-{key}.journal.jsonl")),
+        complete=lambda result: not (result[api.STATUS_COLUMN] == "failed").any())
+    intermediate(keywords, api.OUTPUT_FILE)
+
+    expanded = cache.run("3_separation", keywords, code_hash(separation), "",
+                         lambda key: run_separation(keywords))
+    intermediate(expanded, separation.OUTPUT_FILE)
+
+    result = cache.run("4_final", expanded, code_hash(final), "",
+                       lambda key: run_final(expanded))
+
+    spa_io.write_table(result, args.output)
+    print(f"Écrit: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
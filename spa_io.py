@@ -0,0 +1,107 @@
+import ast
+import json
+import numpy as np
+import pandas as pd
+
+# ============================================================
+# FORMAT DES FICHIERS INTERMÉDIAIRES
+# ============================================================
+# Chaque étape lit et écrit du CSV par défaut ; un chemin en .parquet
+# bascule sur le format colonnes (pyarrow requis) : listes natives pour
+# les mots-clés, booléens et entiers typés, catégories pour les colonnes
+# à peu de valeurs distinctes, et lecture limitée aux colonnes utiles.
+
+LIST_COLUMNS = ["reason_abandon", "behavior_keywords", "compatibility_keywords",
+                "health_keywords", "adoption_keywords"]
+CATEGORY_COLUMNS = ["behavior_category", "health_category", "adoption_category",
+                    "compatibility_tags", "family", "status", "delta_status"]
+BOOL_VALUES = {True, False, "True", "False", "true", "false"}
+
+
+def to_list(x):
+    if isinstance(x, list):
+        return x
+    if pd.isna(x):
+        return []
+    s = str(x).strip()
+    if not s or s.lower() in ["nan", "none"]:
+        return []
+    try:
+        val = ast.literal_eval(s)
+        if isinstance(val, list):
+            return val
+        else:
+            return [val]
+    except Exception:
+        cleaned = s.replace("[", "").replace("]", "").replace("'", "")
+        return [v.strip() for v in cleaned.split(",") if v.strip()]
+
+
+def parse_list_cell(x):
+    """Cellule de mots-clés -> liste, aux deux formats écrits par 2_api_csv.py.
+
+    JSON d'abord (--list-format json), sinon repr Python : une cellule qui
+    commence par `["` n'est pas forcément du JSON, repr passe aux guillemets
+    doubles dès qu'un élément contient une apostrophe (["besoin d'espace", 'calme']).
+    """
+    if isinstance(x, str) and x.lstrip().startswith('["'):
+        try:
+            val = json.loads(x)
+            if isinstance(val, list):
+                return val
+        except ValueError:
+            pass
+    return to_list(x)
+
+
+def is_parquet(path):
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+
+def compact_dtypes(df):
+    """Types compacts avant écriture en Parquet (le CSV n'est pas concerné)."""
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if col in CATEGORY_COLUMNS:
+            df[col] = values.astype("category")
+        elif values.dtype == object or isinstance(values.dtype, pd.StringDtype):
+            present = values.dropna()
+            if len(present) and present.map(lambda v: isinstance(v, (bool, str)) and v in BOOL_VALUES).all():
+                df[col] = values.map(lambda v: v in (True, "True", "true"),
+                                     na_action="ignore").astype("boolean")
+            elif (col == "id" or col.endswith("_id")) and len(present) \
+                    and present.astype(str).str.fullmatch(r"-?\d+").all():
+                df[col] = pd.to_numeric(values).astype("Int64")
+        elif values.dtype.kind == "f" and (col == "id" or col.endswith("_id")):
+            present = values.dropna()
+            if (present == np.floor(present)).all():
+                df[col] = values.astype("Int64")
+    return df
+
+
+def read_table(path, columns=None, **csv_kwargs):
+    """CSV ou Parquet selon l'extension ; `columns` limite la lecture aux
+    colonnes utiles (celles absentes du fichier sont ignorées)."""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        if columns is not None:
+            available = set(pq.read_schema(path).names)
+            columns = [c for c in columns if c in available]
+        df = pd.read_parquet(path, columns=columns)
+        # Les listes Parquet arrivent en tableaux numpy : on revient à des listes Python
+        for col in LIST_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].map(lambda v: list(v) if isinstance(v, np.ndarray) else v)
+        return df
+    if columns is not None:
+        wanted = set(columns)
+        csv_kwargs["usecols"] = lambda c: c in wanted
+    return pd.read_csv(path, **csv_kwargs)
+
+
+def write_table(df, path, **csv_kwargs):
+    if is_parquet(path):
+        compact_dtypes(df).to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, **csv_kwargs)
@@ -0,0 +1,216 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+# ============================================================
+# MÉTRIQUES PARTAGÉES PAR LES 4 ÉTAPES
+# ============================================================
+# Compteurs et histogrammes en mémoire, alimentés par chaque script
+# (lignes/s par étape, latences HTTP et LLM, tokens, coût...), écrits à
+# la fin avec --metrics : JSON lisible par un script, et même contenu au
+# format texte Prometheus (.prom, pour le textfile collector de
+# node_exporter). Les mises à jour sont protégées par un verrou : le
+# crawl et le mode async appellent depuis plusieurs threads.
+
+PREFIX = "spa_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROFILE_TOP = 25  # Fonctions affichées après --profile (tri par temps cumulé)
+
+_lock = threading.Lock()
+_counters = {}    # (nom, labels) -> valeur
+_histograms = {}  # (nom, labels) -> [compte par bucket..., +Inf], somme, total
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Ajoute une mesure (en secondes) à l'histogramme `name`."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+                break
+        else:
+            hist["buckets"][-1] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Ajoute la durée du bloc au compteur `name` (en secondes)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        inc(name, time.perf_counter() - start, **labels)
+
+
+class _Stage:
+    rows = 0
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Durée et lignes traitées d'une étape ; l'appelant renseigne `.rows`.
+
+    Appelé plusieurs fois (pages du mode streaming, blocs...), les durées
+    et les lignes s'additionnent : le débit reste lignes totales / durée.
+    """
+    s = _Stage()
+    with timer("stage_seconds_total", stage=name):
+        yield s
+    inc("stage_rows_total", s.rows, stage=name)
+
+
+def take():
+    """Vide et renvoie les métriques du processus (pour les remonter d'un worker)."""
+    with _lock:
+        data = (dict(_counters), {k: dict(v, buckets=list(v["buckets"])) for k, v in _histograms.items()})
+        _counters.clear()
+        _histograms.clear()
+    return data
+
+
+def merge(data):
+    """Ajoute les métriques renvoyées par take() dans un autre processus."""
+    counters, histograms = data
+    with _lock:
+        for key, value in counters.items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, other in histograms.items():
+            hist = _histograms.setdefault(
+                key, {"buckets": [0] * len(other["buckets"]), "sum": 0.0, "count": 0})
+            hist["buckets"] = [a + b for a, b in zip(hist["buckets"], other["buckets"])]
+            hist["sum"] += other["sum"]
+            hist["count"] += other["count"]
+
+# ============================================================
+# EXPORT : JSON ET TEXTFILE PROMETHEUS
+# ============================================================
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: dict(v, buckets=list(v["buckets"])) for k, v in _histograms.items()}
+
+    stages = {}
+    for (name, labels), value in counters.items():
+        if name in ("stage_seconds_total", "stage_rows_total"):
+            entry = stages.setdefault(dict(labels)["stage"], {"rows": 0, "seconds": 0.0})
+            entry["rows" if name == "stage_rows_total" else "seconds"] += value
+    for entry in stages.values():
+        entry["rows_per_s"] = round(entry["rows"] / entry["seconds"], 1) if entry["seconds"] else None
+        entry["seconds"] = round(entry["seconds"], 4)
+
+    def labelled(items):
+        return [{"name": name, "labels": dict(labels), **value}
+                for (name, labels), value in sorted(items, key=lambda kv: kv[0])]
+
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": stages,
+        "counters": labelled((k, {"value": v}) for k, v in counters.items()),
+        "histograms": labelled(
+            (k, {"buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], v["buckets"])),
+                 "sum": v["sum"], "count": v["count"]}) for k, v in histograms.items()),
+    }
+
+
+def _number(value):
+    # Pas de {:g} : 6 chiffres significatifs seulement (1234567 -> 1.23457e+06)
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def to_prometheus():
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, dict(v)) for k, v in _histograms.items())
+
+    lines, typed = [], set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            typed.add(name)
+        lines.append(f"{PREFIX}{name}{_labels_text(labels)} {_number(value)}")
+    for (name, labels), hist in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], hist["buckets"]):
+            cumulative += count
+            lines.append(f"{PREFIX}{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{PREFIX}{name}_sum{_labels_text(labels)} {_number(hist['sum'])}")
+        lines.append(f"{PREFIX}{name}_count{_labels_text(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def prometheus_path(path):
+    return os.path.splitext(path)[0] + ".prom"
+
+
+def write(path):
+    """Écrit `path` (JSON) et, à côté, le même contenu en .prom."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2)
+    # Écriture atomique : le collector ne doit jamais lire un fichier à moitié écrit
+    prom = prometheus_path(path)
+    with open(prom + ".tmp", "w", encoding="utf-8") as f:
+        f.write(to_prometheus())
+    os.replace(prom + ".tmp", prom)
+    print(f"Métriques : {path}, {prom}")
+
+# ============================================================
+# OPTIONS COMMUNES (--metrics, --profile)
+# ============================================================
+
+
+def add_arguments(parser, name):
+    parser.add_argument("--metrics", nargs="?", const=f"animaux_spa_metrics_{name}.json", default=None,
+                        metavar="JSON", help="écrit les métriques en JSON et au format Prometheus (.prom)")
+    parser.add_argument("--profile", nargs="?", const=f"animaux_spa_profile_{name}.prof", default=None,
+                        metavar="PROF", help="profil cProfile du traitement (lisible avec pstats/snakeviz)")
+
+
+@contextlib.contextmanager
+def session(args):
+    """Entoure le traitement d'un script : profil si --profile, export si --metrics."""
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            print(f"Profil : {args.profile}")
+        if args.metrics:
+            write(args.metrics)
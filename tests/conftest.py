@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les scripts sont à la racine du dépôt (noms en chiffre, importés par importlib)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
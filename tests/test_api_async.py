@@ -0,0 +1,111 @@
+import asyncio
+import importlib
+import time
+
+api = importlib.import_module("2_api_csv")
+benchmark = importlib.import_module("benchmark")
+
+
+def test_token_bucket_grants_request_larger_than_reduced_rate():
+    # Après un 429, le débit courant (750) est plus petit que la requête (900) :
+    # elle doit partir dès que le seau est plein au lieu d'attendre indéfiniment.
+    bucket = api.TokenBucket(600, 1000)
+
+    async def scenario():
+        await bucket.acquire(900)
+        bucket.penalize(0.01)
+        bucket.updated -= 60  # une minute de remplissage
+        await asyncio.wait_for(bucket.acquire(900), timeout=2)
+
+    asyncio.run(scenario())
+    assert bucket.tokens < 0
+
+
+def test_async_path_recovers_from_rate_limits_errors_and_invalid_replies(monkeypatch):
+    monkeypatch.setattr(api, "_cache", None)
+    monkeypatch.setattr(api, "PROGRESS", False)
+    monkeypatch.setattr(api, "RETRY_BASE_DELAY", 0.01)
+    texts = [f"Chat numéro {i}, calme et vacciné" for i in range(30)]
+
+    with benchmark.FakeResponsesServer(latency=0.005, rate_limit_rate=0.15, error_rate=0.1,
+                                       invalid_rate=0.05, retry_after=0.01) as server:
+        monkeypatch.setattr(api, "BASE_URL", server.url)
+        start = time.perf_counter()
+        results = asyncio.run(api.analyze_all_async(texts, concurrency=4, rpm=60_000,
+                                                    tpm=10_000_000, retries=8))
+        elapsed = time.perf_counter() - start
+
+    assert len(results) == len(texts)
+    assert all(r[api.STATUS_COLUMN] in ("ok", "retried") for r in results)
+    assert any(r[api.STATUS_COLUMN] == "retried" for r in results)
+    assert all(set(api.KEYWORD_COLUMNS) <= set(r) for r in results)
+    assert server.status_counts.get(429) and server.status_counts.get(500)
+    assert elapsed < 30
+
+
+def test_rate_limited_batch_is_retried_whole_not_split(monkeypatch):
+    monkeypatch.setattr(api, "_cache", None)
+    monkeypatch.setattr(api, "_client", None)
+    monkeypatch.setattr(api, "PROGRESS", False)
+    monkeypatch.setattr(api, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(api, "MAX_RETRIES", 20)
+    texts = [f"Chien numéro {i}, joueur" for i in range(10)]
+
+    with benchmark.FakeResponsesServer(latency=0.001, rate_limit_rate=0.7, retry_after=0.01) as server:
+        monkeypatch.setattr(api, "BASE_URL", server.url)
+        results = api.analyze_all(texts, batch_size=5)
+
+    assert server.status_counts.get(429)
+    assert server.status_counts[200] == 2  # un appel réussi par lot, aucun redécoupage
+    assert [r[api.STATUS_COLUMN] for r in results] == ["ok"] * len(texts)
+
+
+def test_async_session_shares_client_and_bucket_across_pages(monkeypatch):
+    monkeypatch.setattr(api, "_cache", None)
+    monkeypatch.setattr(api, "PROGRESS", False)
+    pages = [[f"Lapin numéro {p}-{i}, calme" for i in range(5)] for p in range(3)]
+
+    with benchmark.FakeResponsesServer(latency=0.001) as server:
+        monkeypatch.setattr(api, "BASE_URL", server.url)
+        session = api.AsyncSession(concurrency=2, rpm=600, tpm=10_000_000)
+        try:
+            bucket = session.bucket
+            for texts in pages:
+                results = session.run(api.analyze_all_async(texts, batch_size=1, session=session))
+                assert [r[api.STATUS_COLUMN] for r in results] == ["ok"] * len(texts)
+        finally:
+            session.close()
+
+    # Le seau n'a pas été rempli à neuf à chaque page : il a payé les 15 requêtes
+    assert session.bucket is bucket and bucket.requests < 600 - 10
+
+
+def test_no_backoff_after_last_attempt(monkeypatch):
+    import openai
+
+    monkeypatch.setattr(api, "_cache", None)
+    sleeps = []
+
+    def down(**kwargs):
+        raise openai.APIConnectionError(request=None)
+
+    monkeypatch.setattr(api, "create_response", down)
+    monkeypatch.setattr(api.time, "sleep", sleeps.append)
+    assert api.request_description("Chat calme", retries=3)[api.STATUS_COLUMN] == "failed"
+    assert len(sleeps) == 3
+
+    class DownClient:
+        class responses:
+            @staticmethod
+            async def create(**kwargs):
+                raise openai.APIConnectionError(request=None)
+
+    async def no_wait(delay):
+        sleeps.append(delay)
+
+    sleeps.clear()
+    monkeypatch.setattr(api.asyncio, "sleep", no_wait)
+    result = asyncio.run(api.request_description_async(
+        DownClient(), "Chat calme", api.TokenBucket(60_000, 10_000_000), asyncio.Semaphore(1), retries=3))
+    assert result[api.STATUS_COLUMN] == "failed"
+    assert len(sleeps) == 3
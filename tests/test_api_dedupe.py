@@ -0,0 +1,14 @@
+import importlib
+
+api = importlib.import_module("2_api_csv")
+
+
+def test_near_duplicates_ignore_numbers_and_punctuation_but_keep_word_order():
+    texts = [
+        "Rex, 2 ans : s'entend avec les chats mais pas avec les chiens",
+        "Rex, 3 ans: s'entend avec les chats, mais pas avec les chiens !",
+        "Rex, 3 ans : s'entend avec les chiens mais pas avec les chats",
+    ]
+    representatives, groups = api.dedupe_descriptions(texts, near_duplicates=True)
+    assert groups == [0, 0, 1]
+    assert representatives == [texts[0], texts[2]]
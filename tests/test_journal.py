@@ -0,0 +1,55 @@
+import importlib
+
+import pandas as pd
+
+api = importlib.import_module("2_api_csv")
+
+DESCRIPTIONS = ["Chat calme et câlin, vacciné", "Chien joueur, ok enfants",
+                "Lapin craintif, besoin de patience", "Chatte sociable, stérilisée"]
+
+
+def run(tmp_path, monkeypatch, descriptions, backend="local"):
+    monkeypatch.setattr(api, "BACKEND", backend)
+    monkeypatch.setattr(api, "HYBRID_THRESHOLD", 0.0)  # hybride : tout reste en local
+    monkeypatch.setattr(api, "PROGRESS", False)
+    monkeypatch.setattr(api, "_cache", None)
+    analyzed = []
+    local = api.extract_keywords_local_scored
+    monkeypatch.setattr(api, "extract_keywords_local_scored",
+                        lambda text: analyzed.append(text) or local(text))
+    df = pd.DataFrame({"id": [1, 2, 3, 4], "description": descriptions})
+    args = api.parse_args(["--journal", str(tmp_path / "journal.jsonl")])
+    return api.process_frame(df, args), analyzed
+
+
+def test_resume_skips_done_rows(tmp_path, monkeypatch):
+    first, analyzed = run(tmp_path, monkeypatch, DESCRIPTIONS)
+    assert analyzed == DESCRIPTIONS
+    again, analyzed = run(tmp_path, monkeypatch, DESCRIPTIONS)
+    assert analyzed == []
+    pd.testing.assert_frame_equal(again, first)
+
+
+def test_resume_reruns_rows_whose_description_or_backend_changed(tmp_path, monkeypatch):
+    first, _ = run(tmp_path, monkeypatch, DESCRIPTIONS)
+    edited = DESCRIPTIONS[:2] + ["Lapin très joueur, vacciné"] + DESCRIPTIONS[3:]
+    result, analyzed = run(tmp_path, monkeypatch, edited)
+    assert analyzed == [edited[2]]
+    assert result["behavior_keywords"].iloc[2] != first["behavior_keywords"].iloc[2]
+    assert result["behavior_keywords"].iloc[2] == api.extract_keywords_local(edited[2])["behavior_keywords"]
+
+    _, analyzed = run(tmp_path, monkeypatch, edited, backend="hybrid")
+    assert analyzed == edited
+
+
+def test_truncated_last_line_is_ignored_and_its_row_redone(tmp_path, monkeypatch):
+    first, _ = run(tmp_path, monkeypatch, DESCRIPTIONS)
+    path = tmp_path / "journal.jsonl"
+    lines = path.read_text(encoding="utf-8").splitlines(keepends=True)
+    path.write_text("".join(lines[:-1]) + lines[-1][:len(lines[-1]) // 2], encoding="utf-8")
+
+    result, analyzed = run(tmp_path, monkeypatch, DESCRIPTIONS)
+    assert analyzed == [DESCRIPTIONS[-1]]
+    pd.testing.assert_frame_equal(result, first)
+    _, analyzed = run(tmp_path, monkeypatch, DESCRIPTIONS)  # la ligne rajoutée est lisible
+    assert analyzed == []
@@ -0,0 +1,40 @@
+import importlib
+
+import pandas as pd
+
+import spa_io
+
+api = importlib.import_module("2_api_csv")
+sep = importlib.import_module("3_csv_mots_clés_séparés")
+
+# repr passe aux guillemets doubles dès qu'un élément contient une apostrophe
+CELLS = {
+    str(["besoin d'espace", "calme"]): ["besoin d'espace", "calme"],
+    str(["calme", "besoin d'espace"]): ["calme", "besoin d'espace"],
+    str(["l'enfant", "d'autres chats"]): ["l'enfant", "d'autres chats"],
+    '["joueur", "câlin"]': ["joueur", "câlin"],
+    "['joueur', 'câlin']": ["joueur", "câlin"],
+    "[]": [],
+}
+
+
+def test_parse_list_column_reads_mixed_quotes_and_apostrophes():
+    col = pd.Series(list(CELLS) + [None])
+    assert sep.parse_list_column(col).tolist() == list(CELLS.values()) + [[]]
+
+
+def test_retry_failed_reads_mixed_quotes_and_apostrophes(tmp_path):
+    previous = pd.DataFrame({
+        "id": range(len(CELLS)),
+        "description": [f"annonce {i}" for i in range(len(CELLS))],
+        **{col: list(CELLS) for col in api.KEYWORD_COLUMNS},
+        api.STATUS_COLUMN: "ok",
+    })
+    spa_io.write_table(previous, tmp_path / "prev.csv")
+    journal = api.Journal(str(tmp_path / "journal.jsonl"))
+    try:
+        api.prepare_retry_failed(journal, str(tmp_path / "prev.csv"))
+    finally:
+        journal.close()
+    for key, expected in zip(map(str, range(len(CELLS))), CELLS.values()):
+        assert all(journal.done[key][col] == expected for col in api.KEYWORD_COLUMNS)
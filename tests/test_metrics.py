@@ -0,0 +1,14 @@
+import spa_metrics
+
+
+def test_prometheus_export_keeps_full_precision():
+    spa_metrics.take()
+    spa_metrics.inc("llm_tokens_total", 1234567, kind="input")
+    spa_metrics.inc("llm_cost_usd_total", 0.123456789)
+    spa_metrics.observe("llm_request_duration_seconds", 1234.5678901)
+    text = spa_metrics.to_prometheus()
+    spa_metrics.take()
+
+    assert 'spa_llm_tokens_total{kind="input"} 1234567\n' in text
+    assert "spa_llm_cost_usd_total 0.123456789\n" in text
+    assert "spa_llm_request_duration_seconds_sum 1234.5678901\n" in text
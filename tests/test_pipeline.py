@@ -0,0 +1,49 @@
+import importlib
+import json
+import os
+
+import pandas as pd
+
+pipeline = importlib.import_module("pipeline")
+api = pipeline.api
+
+
+def test_incomplete_stage_is_not_cached_and_keeps_its_journal(tmp_path):
+    cache = pipeline.StageCache(str(tmp_path))
+    df = pd.DataFrame({"description": ["a", "b"]})
+    calls = []
+
+    def func(key):
+        calls.append(key)
+        open(tmp_path / f"2_api-{key}.journal.jsonl", "a").close()
+        return df.assign(status=["ok", "failed" if len(calls) == 1 else "retried"])
+
+    def complete(result):
+        return not (result["status"] == "failed").any()
+
+    cache.run("2_api", df, "code", "", func, complete=complete)
+    assert os.listdir(tmp_path) == [f"2_api-{calls[0]}.journal.jsonl"]
+    result = cache.run("2_api", df, "code", "", func, complete=complete)
+    assert calls == [calls[0]] * 2 and result["status"].tolist() == ["ok", "retried"]
+    assert os.listdir(tmp_path) == [f"2_api-{calls[0]}.pkl"]
+    cache.run("2_api", df, "code", "", func, complete=complete)
+    assert len(calls) == 2
+
+
+def test_run_api_retries_failed_rows_of_a_kept_journal(tmp_path, monkeypatch):
+    for name in ("BACKEND", "BASE_URL", "MAX_RETRIES", "STRUCTURED_OUTPUT", "HYBRID_THRESHOLD"):
+        monkeypatch.setattr(api, name, getattr(api, name))
+    monkeypatch.setattr(api, "PROGRESS", False)
+    monkeypatch.setattr(api, "BACKEND", "local")
+    df = pd.DataFrame({"id": [1, 2], "description": ["Chat calme", "Chien joueur, vacciné"]})
+    sigs = api.journal_signatures(df["description"])
+    journal = tmp_path / "2_api-k.journal.jsonl"
+    with open(journal, "w", encoding="utf-8") as f:
+        for row, sig, status in zip(["1", "2"], sigs, ["ok", "failed"]):
+            result = dict(api.empty_result(status), behavior_keywords=[status])
+            f.write(json.dumps({"row": row, "sig": sig, "result": result}) + "\n")
+
+    result = pipeline.run_api(df, "--backend local", str(journal))
+
+    assert result["behavior_keywords"].iloc[0] == ["ok"]  # repris du journal
+    assert result[api.STATUS_COLUMN].tolist() == ["ok", "ok"]  # l'échec a été relancé
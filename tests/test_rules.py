@@ -0,0 +1,48 @@
+import copy
+import importlib
+
+final = importlib.import_module("4_csv_final")
+
+
+def test_compiled_matchers_agree_with_naive_substring_loops():
+    tokens = final.synthetic_tokens(20_000, seed=1)
+    for name, rules, _ in final.RULE_TABLES:
+        matcher = final.RuleMatcher(rules)  # memo neuf, indépendant des autres tests
+        diffs = [t for t in tokens if matcher.first(t) != final.first_rule_naive(t, rules)]
+        assert diffs == [], f"{name}: {diffs[:5]}"
+
+
+def test_self_check_passes():
+    assert final.self_check(5_000)
+
+
+def test_category_cache_sync_only_invalidates_tokens_touched_by_the_change(tmp_path):
+    old = copy.deepcopy(final.BEHAVIOR_RULES)
+    new = copy.deepcopy(old)
+    rules = dict(new)
+    rules["Calme/Posé"]["substr"].remove("calme")            # déplacée...
+    rules["Sociable/Affectueux/Joyeux"]["substr"].append("calme")  # ...vers une autre règle
+    rules["Calme/Posé"]["substr"].append("zen")               # ajoutée
+    rules["Indépendant/Solitaire"]["substr"].remove("seul")  # retirée
+    tokens = sorted(set(final.synthetic_tokens(5_000, seed=2)
+                        + ["tres_calme", "zen_total", "vit_seul", "seul_chat", "joueur"]))
+
+    cache = final.CategoryCache(str(tmp_path / "categories.sqlite"))
+    try:
+        cache.sync("behavior", old)
+        matcher = final.RuleMatcher(old)
+        for t in tokens:
+            matcher.first(t)
+        cache.save("behavior", matcher)
+
+        kept, invalidated = cache.sync("behavior", new)
+        matcher = final.RuleMatcher(new)
+        cache.load("behavior", matcher)
+    finally:
+        cache.close()
+
+    untouched = {t for t in tokens if not any(sub in t for sub in ("calme", "zen", "seul"))}
+    assert set(matcher.memo) == untouched
+    assert (kept, invalidated) == (len(untouched), len(tokens) - len(untouched))
+    assert 0 < invalidated < len(tokens)
+    assert [matcher.first(t) for t in tokens] == [final.first_rule_naive(t, new) for t in tokens]
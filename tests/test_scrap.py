@@ -0,0 +1,75 @@
+import importlib
+
+scrap = importlib.import_module("1_scrap_site_spa")
+benchmark = importlib.import_module("benchmark")
+
+ANIMALS = benchmark.search_records(benchmark.synthetic_animals(120))
+PAGE_SIZE = 10  # 12 pages pleines, puis des pages vides
+
+
+def crawl(server, concurrency=4, **kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    return list(scrap.iter_pages(concurrency, base_url=server.url, **kwargs))
+
+
+def test_pages_come_back_in_order_even_when_early_pages_are_slow():
+    with benchmark.FakeSearchServer(ANIMALS, PAGE_SIZE, latency=0.005,
+                                    latencies={1: 0.2, 2: 0.1, 5: 0.15}) as server:
+        pages = crawl(server)
+
+    assert [page for page, _ in pages] == list(range(1, 13))
+    assert [a["id"] for _, animals in pages for a in animals] == [a["id"] for a in ANIMALS]
+    assert all({"fad", "expr", "sos"} <= set(a) for _, animals in pages for a in animals)
+
+
+def test_requests_in_flight_never_exceed_concurrency():
+    for concurrency in (1, 3):
+        with benchmark.FakeSearchServer(ANIMALS, PAGE_SIZE, latency=0.03) as server:
+            pages = crawl(server, concurrency)
+        assert len(pages) == 12
+        assert server.max_in_flight <= concurrency
+    assert server.max_in_flight > 1  # les pages partent bien en parallèle
+
+
+def test_429_and_5xx_are_retried_and_retry_after_is_respected():
+    failures = {3: [(429, {"Retry-After": "1"})], 7: [(503, {}), (500, {})]}
+    with benchmark.FakeSearchServer(ANIMALS, PAGE_SIZE, latency=0.001, failures=failures) as server:
+        failed = []
+        pages = crawl(server, failed=failed)
+
+    assert [page for page, _ in pages] == list(range(1, 13))
+    assert failed == []
+    assert len(server.hits[3]) == 2 and len(server.hits[7]) == 3
+    assert server.hits[3][1] - server.hits[3][0] >= 1.0  # Retry-After: 1
+
+
+def test_page_failing_after_retries_is_reported_not_taken_for_the_end():
+    failures = {5: [(500, {})] * 3}
+    with benchmark.FakeSearchServer(ANIMALS, PAGE_SIZE, latency=0.001, failures=failures) as server:
+        failed = []
+        pages = crawl(server, retries=2, failed=failed)
+
+    assert [page for page, _ in pages] == [1, 2, 3, 4]
+    assert failed == [5]
+
+
+def test_incomplete_crawl_keeps_previous_outputs(tmp_path):
+    paths = {name: tmp_path / f"{name}.csv" for name in ("output", "delta-output", "removed-output")}
+    paths["store"] = tmp_path / "store.json"
+    previous = {path: '{"animals": {"1": "x"}}' if name == "store" else "précédent\n"
+                for name, path in paths.items()}
+    for path, text in previous.items():
+        path.write_text(text, encoding="utf-8")
+    argv = [f"--{name}={path}" for name, path in paths.items()]
+
+    with benchmark.FakeSearchServer(ANIMALS, PAGE_SIZE, latency=0.001,
+                                    failures={5: [(500, {})] * 2}) as server:
+        try:
+            scrap.run(scrap.parse_args(argv + ["--delta", "--retries=1", f"--base-url={server.url}"]))
+        except SystemExit as e:
+            assert e.code == 1
+        else:
+            raise AssertionError("le crawl incomplet doit sortir en erreur")
+
+    assert all(path.read_text(encoding="utf-8") == text for path, text in previous.items())
+    assert (tmp_path / "output.csv.part").exists()  # crawl partiel gardé pour inspection
@@ -0,0 +1,27 @@
+import importlib
+
+import pandas as pd
+
+sep = importlib.import_module("3_csv_mots_clés_séparés")
+
+
+def frame():
+    lists = {
+        "reason_abandon": [["déménagement"], [], ["allergie", "décès"], []],
+        "behavior_keywords": [["calme", "joueur", "câlin"], [], ["besoin d'espace"], []],
+        "compatibility_keywords": [[], [], ["ok_chats", "pas_chiens"], ["ok_enfants"]],
+        "health_keywords": [["vacciné"], [], [], []],
+        "adoption_keywords": [[], [], ["jardin"], ["fad"]],
+    }
+    return pd.DataFrame({"id": [10, 11, 12, 13], "name": ["Rex", "Mia", "Oslo", None],
+                         "age": [2.5, None, 7.0, 1.0], **lists, "status": "ok"})
+
+
+def test_expand_lists_matches_iterrows_reference():
+    df = frame()  # la ligne 11 n'a que des listes vides : elle sort une fois, sans mot-clé
+    fast = sep.expand_lists(df)
+    legacy = sep.expand_lists_iterrows(df)
+
+    assert fast.to_csv(index=False) == legacy.to_csv(index=False)
+    assert fast["id"].tolist() == [10, 10, 10, 11, 12, 12, 13]
+    assert fast.loc[fast["id"] == 11, [f"{c}_separated" for c in sep.list_cols]].isna().all(axis=None)